@@ -11,17 +11,30 @@
 #'  @param inputTripFile: Trip list from TM1 100% run
 #'  @param outputTripFile: File name of output trip list
 #'  @param jointFlag: [True/False] Logical variable indicating whether the trip list being processed is joint or individual
+#'  @param aliasTableFile: File holding the (Walker alias) probability tables, which are reused while their inputs are unchanged
+#'  @param randomSeed: Seed of the random draws; the draws of each trip depend only on it and the trip's row in the trip list
+#'  @param tripChunkSize: Number of trips read, disaggregated and written at a time
 #'        
 #'  @date: 2014-04-14
 #'  @author: sn, narayanamoorthys AT pbworld DOT com
 
+import os, sys
 import numpy as np
 import pandas as pd
-import gc
 from time import strftime
 import itertools as iterT
 from collections import OrderedDict
 
+#the typed maz data cache and the zone aggregation are shared with the model scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','..','model-files','scripts','common'))
+import file_cache
+import zone_aggregation
+import zone_data
+
+ALIAS_TABLE_VERSION = 1
+RNG_BLOCK = 100000 #trips per random number substream
+incomeCategories = ['low', 'med', 'high', 'very high']
+
 ########################################################################################################
 #Inputs
 ########################################################################################################
@@ -33,171 +46,201 @@ geographicCWalkFile = 'data/geographicCWalk.csv'
 inputTripFile = 'data/indivTripData_3.csv'
 outputTripFile = 'indivTripData_3.csv'
 jointFlag = False
+aliasTableFile = 'data/sizeTermAliasTables.npz'
+randomSeed = 0
+tripChunkSize = 1000000
+
+#Size-term categories, each the sum of the listed MAZ data columns
+sizeCategories = OrderedDict([('TOTHH', ['HH'])
+            ,('RETEMPN', ['emp_personal_svcs_retail', 'emp_retail'])
+            ,('FPSEMPN', ['emp_prof_bus_svcs'])
+            ,('HEREMPN', ['emp_amusement', 'emp_restaurant_bar', 'emp_pvt_ed_post_k12_oth', 'emp_public_ed', 'emp_health', 'emp_hotel', 'emp_personal_svcs_retail'])
+            ,('OTHEMPN', ['emp_const_non_bldg_prod', 'emp_state_local_gov_ent', 'emp_prof_bus_svcs'])
+            ,('AGREMPN', ['emp_ag', 'emp_const_non_bldg_prod'])
+            ,('MWTEMPN', ['emp_whsle_whs', 'emp_mfg_prod', 'emp_trans', 'emp_utilities_prod'])
+            ,('HSENROLL', ['EnrollGrade9to12'])
+            ,('COLLFTE', ['collegeEnroll'])
+            ,('COLLPTE', ['otherCollegeEnroll', 'AdultSchEnrl'])
+            ,('AGE0519', [])
+            ,('TOTEMP', ['emp_total'])])
 
 ########################################################################################################
 #Function definitions
 ########################################################################################################
 
+#Walker alias table of a probability array
+def aliasTable(probs):
+    "The probability of keeping each entry when it is drawn, and the entry it is otherwise aliased to"
+    n = len(probs)
+    scaled = (probs * (n / probs.sum())).tolist()
+    keep, alias = np.ones(n), np.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        keep[s], alias[s] = scaled[s], l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    return keep, alias
+
+#Walker alias tables of the MAZs of all (purpose, TM1 TAZ) groups, flattened into one CSR-style table
+def buildAliasTables(sizeCoeff, sizeData):
+    "Groups keyed by purpose index * tazBase + TAZ, with offsets into the concatenated MAZs, keep probabilities and (table) aliases"
+    sizeData = sizeData.sort_index()
+    tazs = sizeData.index.get_level_values('TAZ1454').values.astype(np.int64)
+    terms = [term for term in sizeCoeff.columns if term in sizeData.columns]
+    purposes = [str(p) if p == s else str(p) + '_' + str(s) for (p, s) in sizeCoeff.index]
+
+    #Determine the MAZ size totals of all purposes at once (missing data or coefficients count as zero)
+    #Update MAZ groups with zero size to a small value (0.001) so as to assign equal probability
+    mazSIZE = np.dot(np.nan_to_num(sizeData[terms].values.astype(np.float64)), np.nan_to_num(sizeCoeff[terms].values.astype(np.float64)).T)
+    (groupTazs, grouping) = zone_aggregation.grouping_matrix(tazs)
+    mazGroup = np.searchsorted(groupTazs, tazs)
+    mazSIZE[(grouping.dot(mazSIZE) == 0)[mazGroup]] = 0.001
+
+    #Determine the MAZ probabilities, and the alias tables of those that can be drawn
+    mazPROB = mazSIZE / grouping.dot(mazSIZE)[mazGroup]
+    tazBase = tazs.max() + 1 if len(tazs) > 0 else 1
+    groupKeys, offsets, mazs, keeps, aliases = [], [0], [], [], []
+    for p in range(len(purposes)):
+        rows = np.flatnonzero(mazPROB[:, p] > 0)
+        starts = np.flatnonzero(np.concatenate(([True], tazs[rows[1:]] != tazs[rows[:-1]], [True])))
+        for (start, stop) in zip(starts[:-1], starts[1:]):
+            keep, alias = aliasTable(mazPROB[rows[start:stop], p])
+            groupKeys.append(p * tazBase + tazs[rows[start]])
+            mazs.append(sizeData.index.get_level_values('MAZ').values[rows[start:stop]])
+            keeps.append(keep)
+            aliases.append(alias + offsets[-1])
+            offsets.append(offsets[-1] + stop - start)
+    return {'purposes': np.array(purposes), 'tazBase': tazBase, 'groupKeys': np.array(groupKeys, dtype=np.int64),
+            'offsets': np.array(offsets, dtype=np.int64), 'MAZ': np.concatenate(mazs), 'keep': np.concatenate(keeps),
+            'alias': np.concatenate(aliases)}
+
+#Reading and writing the alias tables, which are valid while the key (of the inputs they are built from) is unchanged
+def readAliasTables(aliasTableFile, key):
+    "The alias tables in aliasTableFile, or None if there are none or their key is not key"
+    if not (os.path.exists(aliasTableFile) and os.path.exists(aliasTableFile + '.key')):
+        return None
+    if open(aliasTableFile + '.key').read() != key:
+        return None
+    tables = np.load(aliasTableFile)
+    return dict((name, tables[name]) for name in tables.files)
+
+def writeAliasTables(aliasTableFile, key, tables):
+    "Writes the alias tables to aliasTableFile; the key is written last, so an interrupted write leaves them invalid"
+    try:
+        if os.path.exists(aliasTableFile + '.key'):
+            os.remove(aliasTableFile + '.key')
+        with open(aliasTableFile, 'wb') as f:
+            np.savez(f, **tables)
+        with open(aliasTableFile + '.key', 'wb') as f:
+            f.write(key)
+    except (IOError, OSError):
+        print 'could not write alias tables ' + aliasTableFile
+
 #Monte Carlo prediction function
-def MonteCarlo(zoneGroupObject): 
-    cumPROB = mazCumPROB[zoneGroupObject.name[0]][zoneGroupObject.name[1]]
-    i = np.searchsorted(cumPROB.values, zoneGroupObject.values, side='left')
-    return cumPROB.index[i]
+def MonteCarlo(aliasTables, tripPurpose, tripTaz, uRandDraw):
+    "The MAZ for each trip, drawn from the alias table of its (purpose, TM1 TAZ) group with one uniform draw"
+    groupKeys = aliasTables['groupKeys']
+    tazBase = int(aliasTables['tazBase'])
+    purposeIndex = pd.Index(aliasTables['purposes']).get_indexer(tripPurpose)
+    tripTazs = tripTaz.astype(np.int64)
+    #keys of unknown purposes or TAZs outside of the tables would alias those of other groups, so they are left invalid
+    known = (tripTazs >= 1) & (tripTazs < tazBase) & (purposeIndex >= 0)
+    tripKey = np.where(known, purposeIndex * tazBase + tripTazs, -1)
+    group = np.minimum(np.searchsorted(groupKeys, tripKey), len(groupKeys) - 1)
+    missing = np.flatnonzero((tripKey < 0) | (groupKeys[group] != tripKey))
+    if len(missing) > 0:
+        raise KeyError('no MAZs for purpose %s in TAZ %s' % (tripPurpose[missing[0]], tripTaz[missing[0]]))
+    #the integer part of the scaled draw picks the entry, and its fraction whether to keep it or take its alias
+    start = aliasTables['offsets'][group]
+    size = aliasTables['offsets'][group + 1] - start
+    scaled = uRandDraw * size
+    entry = np.minimum(scaled.astype(np.int64), size - 1)
+    i = start + entry
+    i = np.where(scaled - entry < aliasTables['keep'][i], i, aliasTables['alias'][i])
+    return aliasTables['MAZ'][i]
 
 #Defining income categories based on TM1
 def incomeCat(incomeInDollars):
-    "low: [-Inf,30k), med: [30k,60k), high: [60k,100k), very high: [100k,+Inf)"
-    if incomeInDollars < 30000:
-        incCat = 'low'
-    elif (incomeInDollars>=30000) & (incomeInDollars<60000):
-        incCat = 'med'
-    elif (incomeInDollars>=60000) & (incomeInDollars<100000):
-        incCat = 'high'
-    else:
-        incCat = 'very high'
-    return incCat
+    "low: [-Inf,30k), med: [30k,60k), high: [60k,100k), very high: [100k,+Inf); as indices into incomeCategories"
+    return np.searchsorted(np.array([30000, 60000, 100000]), incomeInDollars, side='right')
 
 #Segmenting trip purpose
 def segTripPurpose(tripPurpose, incCat):
-    "work: low, med, high, very high"
-    if tripPurpose.lower() == 'work':
-        segTripPurpose = tripPurpose.lower() + '_' + incCat
-    else:
-        segTripPurpose = tripPurpose
+    "work: low, med, high, very high (by the income category index; -1 for unknown households)"
+    segTripPurpose = tripPurpose.values.copy()
+    work = np.flatnonzero((tripPurpose.str.lower() == 'work').values)
+    segTripPurpose[work] = ['work_' + incomeCategories[cat] if cat >= 0 else 'work_unknown income' for cat in incCat[work]]
     return segTripPurpose
 
+#Random number generation
+def uniformDraws(seed, rows):
+    "Two uniform draws (origin and destination) for each (input trip list) row, from the substream of (seed, row // RNG_BLOCK)"
+    draws = np.zeros((len(rows), 2))
+    blocks = rows // RNG_BLOCK
+    for block in np.unique(blocks):
+        inBlock = np.flatnonzero(blocks == block)
+        blockDraws = np.random.RandomState([seed, block]).uniform(low=0.0, high=1.0, size=(RNG_BLOCK, 2))
+        draws[inBlock] = blockDraws[rows[inBlock] % RNG_BLOCK]
+    return draws
+
+#Mapping TM1 to TM2 values
+def recode(values, valueMap):
+    "The values (a pandas.core.Series) mapped through valueMap, with those not in it kept"
+    return pd.Series(np.where(values.isin(list(valueMap)), values.map(valueMap), values), index=values.index).astype(values.dtype)
+
 ########################################################################################################
 # Pre-computing probability arrays 
 ########################################################################################################
 print strftime("%Y-%m-%d %H:%M:%S"), ':Pre-computing probability arrays...'
-#Read in the size-term coefficient data and index it on trip purpose segments
-#Sample query: sizeCoeff.loc['escort'].loc['kids']
-sizeCoeff = pd.read_csv(sizeCoefficientsFile)
-sizeCoeff = sizeCoeff.set_index(['purpose','segment'])
-
-#Read in the employment data 
-mazData = pd.read_csv(mazDataFile)
-geographicCWalk = pd.read_csv(geographicCWalkFile)
-mazData.drop(['MAZ','TAZ','TAZ_ORIGINAL'], axis=1, inplace=True)
-
-#Updating MAZ and TAZ fields in MAZ data file with sequential zone numbering
-mazData = pd.merge(mazData, geographicCWalk, left_on='MAZ_ORIGINAL', right_on='MAZ_ORIGINAL', how='left')
-
-#Read in TM1 TAZ to TM2 MAZ cross-walk
-#Drop MAZs not contained in TM1 zone system
-tm1crosswalk = pd.read_csv(MAZ_to_TM1TAZ_xwalk)
-tm1crosswalk = tm1crosswalk.dropna(subset=['TAZ1454'], how='any') 
-
-#Update TM2 MAZ data with TM1 zone numbers (right_join) -> MAZs that are not contained in TM1 TAZ is dropped
-mazData = pd.merge(mazData, tm1crosswalk, left_on='MAZ_ORIGINAL', right_on='MAZ_ORIGINAL', how='right')
-
-#Collapse socio-demographic and employment data into size-term categories
-sizeData = mazData.loc[:,('TAZ','MAZ','TAZ1454')]
-
-__temp_val = mazData.eval('HH')
-sizeData['TOTHH'] = __temp_val
-
-__temp_val = mazData.eval('emp_personal_svcs_retail + emp_retail')
-sizeData['RETEMPN'] = __temp_val
-
-__temp_val = mazData.eval('emp_prof_bus_svcs')
-sizeData['FPSEMPN'] = __temp_val
-
-__temp_val = mazData.eval('emp_amusement + emp_restaurant_bar + emp_pvt_ed_post_k12_oth + emp_public_ed + emp_health + emp_hotel + emp_personal_svcs_retail')
-sizeData['HEREMPN'] = __temp_val
-
-__temp_val = mazData.eval('emp_const_non_bldg_prod + emp_state_local_gov_ent + emp_prof_bus_svcs')
-sizeData['OTHEMPN'] = __temp_val
-
-__temp_val = mazData.eval('emp_ag + emp_const_non_bldg_prod')
-sizeData['AGREMPN'] = __temp_val
-
-__temp_val = mazData.eval('emp_whsle_whs + emp_mfg_prod + emp_trans + emp_utilities_prod')
-sizeData['MWTEMPN'] = __temp_val
-
-__temp_val = mazData.eval('EnrollGrade9to12')
-sizeData['HSENROLL'] = __temp_val
-
-__temp_val = mazData.eval('collegeEnroll')
-sizeData['COLLFTE'] = __temp_val
-
-__temp_val = mazData.eval('otherCollegeEnroll + AdultSchEnrl')
-sizeData['COLLPTE'] = __temp_val
-
-__temp_val = 0
-sizeData['AGE0519'] = 0
-
-__temp_val = mazData.eval('emp_total')
-sizeData['TOTEMP'] = __temp_val
-
-sizeData = sizeData.set_index(['TAZ1454','MAZ'])
-
-#Declaring dictionaries to hold the arrays with purpose segments as keys
-mazSIZE = {} #Each element holds a pandas.core.Series with size terms 
-tazSIZE = {} #Each element holds a pandas.core.Series with TAZ size totals
-mazPROB = {} #Each element holds a pandas.core.Series with probabilities
-mazCumPROB = {} #Each element holds a pandas.core.Series with cumulative probabilities sorted on MAZ# within TAZ
-
-#Iterate over different trip purpose segments and compute the probability within each TAZ
-for index, row in sizeCoeff.iterrows():
-    #Collect the size coefficients in a pandas.core.Series
-    beta = sizeCoeff.loc[index[0]].loc[index[1]]
-
-    #Determine the market segment being processed
-    if index[0] == index[1]:
-        tripPurpose = str(index[0])
-    else:
-        tripPurpose = str(index[0]) + '_' + str(index[1])
-        
-    #Determine the MAZ size totals
-    #Update MAZ groups with zero size to a small value (0.001) so as to assign equal probability
-    mazSIZE[tripPurpose] = sizeData.mul(beta, axis=1).sum(axis = 1)
-    idx = mazSIZE[tripPurpose].groupby(level='TAZ1454').filter(lambda grp: (grp.sum()) == 0).index
-    mazSIZE[tripPurpose].ix[idx] = 0.001
-
-    #Determine the TAZ size totals
-    tazSIZE[tripPurpose] = mazSIZE[tripPurpose].groupby(level = 'TAZ1454').sum()
-
-    #Determine the MAZ probability and cumulative probabilities
-    mazPROB[tripPurpose] = mazSIZE[tripPurpose].div(tazSIZE[tripPurpose], level = 0)
-    mazCumPROB[tripPurpose] = mazPROB[tripPurpose][mazPROB[tripPurpose]>0].sort_index().groupby(level = 'TAZ1454').cumsum()
+#The alias tables depend only on the size coefficients, the MAZ data, the crosswalks and the size-term categories
+aliasKey = ','.join([str(ALIAS_TABLE_VERSION)] + [file_cache.hash_file(inputFile) for inputFile in
+                    [sizeCoefficientsFile, mazDataFile, MAZ_to_TM1TAZ_xwalk, geographicCWalkFile]] + [repr(sizeCategories.items())])
+aliasTables = readAliasTables(aliasTableFile, aliasKey)
+if aliasTables is None:
+    #Read in the size-term coefficient data and index it on trip purpose segments
+    #Sample query: sizeCoeff.loc['escort'].loc['kids']
+    sizeCoeff = pd.read_csv(sizeCoefficientsFile)
+    sizeCoeff = sizeCoeff.set_index(['purpose','segment'])
+
+    #Read in the employment data 
+    mazData = zone_data.read_frame(mazDataFile, upcast=True)
+    geographicCWalk = pd.read_csv(geographicCWalkFile)
+    mazData.drop(['MAZ','TAZ','TAZ_ORIGINAL'], axis=1, inplace=True)
+
+    #Updating MAZ and TAZ fields in MAZ data file with sequential zone numbering
+    mazData = pd.merge(mazData, geographicCWalk, left_on='MAZ_ORIGINAL', right_on='MAZ_ORIGINAL', how='left')
+
+    #Read in TM1 TAZ to TM2 MAZ cross-walk
+    #Drop MAZs not contained in TM1 zone system
+    tm1crosswalk = pd.read_csv(MAZ_to_TM1TAZ_xwalk)
+    tm1crosswalk = tm1crosswalk.dropna(subset=['TAZ1454'], how='any') 
+
+    #Update TM2 MAZ data with TM1 zone numbers (right_join) -> MAZs that are not contained in TM1 TAZ is dropped
+    mazData = pd.merge(mazData, tm1crosswalk, left_on='MAZ_ORIGINAL', right_on='MAZ_ORIGINAL', how='right')
+
+    #Collapse socio-demographic and employment data into size-term categories (all at once)
+    sizeData = mazData.loc[:,('TAZ','MAZ','TAZ1454')]
+    for category, totals in zone_aggregation.aggregate(mazData, sizeCategories).items():
+        sizeData[category] = totals
+
+    sizeData = sizeData.set_index(['TAZ1454','MAZ'])
+
+    aliasTables = buildAliasTables(sizeCoeff, sizeData)
+    writeAliasTables(aliasTableFile, aliasKey, aliasTables)
+else:
+    print strftime("%Y-%m-%d %H:%M:%S"), ':Read the probability arrays from', aliasTableFile
 
 ########################################################################################################
 # Preparing trip list for simulation
 ########################################################################################################
 print strftime("%Y-%m-%d %H:%M:%S"), ':Preparing trip list for simulation...'
-#Household Data
-hhData = pd.read_csv(householdsFile)
-hhData['INC_CAT'] = hhData['income'].apply(incomeCat)
-hhData = hhData.loc[:,('hh_id','INC_CAT')]
-
-#Read in the trip List
-tripList = pd.read_csv(inputTripFile).reset_index()
-tripList = tripList.query('trip_mode < 9')
-
-#Determine trip purpose segmentation
-tripList = pd.merge(tripList, hhData, left_on='hh_id', right_on='hh_id', how='left')
-tripList['OPURP'] = np.vectorize(segTripPurpose)(tripList['orig_purpose'],tripList['INC_CAT'])
-tripList['DPURP'] = np.vectorize(segTripPurpose)(tripList['dest_purpose'],tripList['INC_CAT'])
-
-#Random number generation
-np.random.seed(0)
-tripList['uRandDrawO'] = pd.Series(np.random.uniform(low=0.0, high=1.0, size=len(tripList)), index=tripList.index)
-tripList['uRandDrawD'] = pd.Series(np.random.uniform(low=0.0, high=1.0, size=len(tripList)), index=tripList.index)
-n = gc.collect()
-
-########################################################################################################
-# Monte Carlo prediction
-########################################################################################################
-print strftime("%Y-%m-%d %H:%M:%S"), ':Starting Monte Carlo prediction...'
-tripList['OMAZ'] = tripList.groupby(['OPURP', 'orig_taz'])['uRandDrawO'].transform(MonteCarlo)
-tripList['DMAZ'] = tripList.groupby(['DPURP', 'dest_taz'])['uRandDrawD'].transform(MonteCarlo)
-print strftime("%Y-%m-%d %H:%M:%S"), ':Completed Monte Carlo prediction...'
-
-########################################################################################################
-# Post-processing - Updating TM1 fields to TM2 
-########################################################################################################
-print strftime("%Y-%m-%d %H:%M:%S"), ':Preparing file for output...'
+#Household Data: the income category (index into incomeCategories) of each household, by household id
+hhData = pd.read_csv(householdsFile, usecols=['hh_id','income'])
+hhIncCat = np.zeros(hhData['hh_id'].max() + 1, dtype=np.int64) - 1
+hhIncCat[hhData['hh_id'].values] = incomeCat(hhData['income'].values)
+del hhData
 
 #Dictionary mapping TM1 to TM2 purpose
 purposeMap = { 'atwork_business' : 'Work-Based'
@@ -260,25 +303,6 @@ modeMap = {1 : 1
             ,17 : 12
             ,18 : 12}
 
-#Updating TM1 trip list fields to match TM2 values
-tripList['orig_purpose'] = tripList['orig_purpose'].apply(lambda x: purposeMap.get(x, x)) 
-tripList['dest_purpose'] = tripList['dest_purpose'].apply(lambda x: purposeMap.get(x, x)) 
-tripList['tour_purpose'] = tripList['tour_purpose'].apply(lambda x: purposeMap.get(x, x)) 
-tripList['trip_mode'] = tripList['trip_mode'].apply(lambda x: modeMap.get(x, x)) 
-tripList['tour_mode'] = tripList['tour_mode'].apply(lambda x: modeMap.get(x, x)) 
-tripList['depart_hour'] = tripList['depart_hour'].apply(lambda x: timePeriodMap.get(x, x)) 
-
-#Drop all transit trips as we would need to predict boarding and alighting TAP information
-tripList = tripList.loc[~tripList['trip_mode'].isin([11,12,13]),:]
-
-#Adding additional fields that are in TM2 trip list and setting them to zero
-tripList['trip_board_tap'] = 0
-tripList['trip_alight_tap'] = 0
-tripList['set'] = -1
-tripList['TRIP_TIME'] = 0
-tripList['TRIP_DISTANCE'] = 0
-tripList['TRIP_COST'] = 0
-
 #Dictionary mapping TM1 to TM2 trip column names
 if jointFlag == True:
     columnMap = OrderedDict([('hh_id', 'hh_id')
@@ -325,11 +349,52 @@ else:
             ,('TRIP_DISTANCE', 'TRIP_DISTANCE')
             ,('TRIP_COST', 'TRIP_COST')])
 
-tripList = tripList.rename(columns=columnMap)
-tripList = tripList.sort('index').drop('index',1)
-tripList = tripList[columnMap.values()]
-
-print strftime("%Y-%m-%d %H:%M:%S"), ':Writing out csv file...'
-##Writing out TM2 trip list
-tripList.to_csv(outputTripFile, index=False)
-print strftime("%Y-%m-%d %H:%M:%S"), ':Complete!'
\ No newline at end of file
+########################################################################################################
+# Monte Carlo prediction and post-processing - Updating TM1 fields to TM2, a chunk of the trip list at a time
+########################################################################################################
+print strftime("%Y-%m-%d %H:%M:%S"), ':Starting Monte Carlo prediction...'
+inputRows = 0
+for chunkIndex, tripList in enumerate(pd.read_csv(inputTripFile, chunksize=tripChunkSize)):
+    #Index the trips by their row in the input trip list, which picks their random draws
+    tripList.index = np.arange(inputRows, inputRows + len(tripList))
+    inputRows += len(tripList)
+    tripList = tripList.reset_index()
+    tripList = tripList.query('trip_mode < 9')
+
+    #Determine trip purpose segmentation
+    incCat = hhIncCat[np.clip(tripList['hh_id'].values, 0, len(hhIncCat) - 1)]
+    incCat[(tripList['hh_id'].values < 0) | (tripList['hh_id'].values >= len(hhIncCat))] = -1
+    tripList['OPURP'] = segTripPurpose(tripList['orig_purpose'], incCat)
+    tripList['DPURP'] = segTripPurpose(tripList['dest_purpose'], incCat)
+
+    #Random number generation and Monte Carlo prediction
+    uRandDraws = uniformDraws(randomSeed, tripList['index'].values)
+    tripList['OMAZ'] = MonteCarlo(aliasTables, tripList['OPURP'].values, tripList['orig_taz'].values, uRandDraws[:,0])
+    tripList['DMAZ'] = MonteCarlo(aliasTables, tripList['DPURP'].values, tripList['dest_taz'].values, uRandDraws[:,1])
+
+    #Updating TM1 trip list fields to match TM2 values
+    tripList['orig_purpose'] = recode(tripList['orig_purpose'], purposeMap)
+    tripList['dest_purpose'] = recode(tripList['dest_purpose'], purposeMap)
+    tripList['tour_purpose'] = recode(tripList['tour_purpose'], purposeMap)
+    tripList['trip_mode'] = recode(tripList['trip_mode'], modeMap)
+    tripList['tour_mode'] = recode(tripList['tour_mode'], modeMap)
+    tripList['depart_hour'] = recode(tripList['depart_hour'], timePeriodMap)
+
+    #Drop all transit trips as we would need to predict boarding and alighting TAP information
+    tripList = tripList.loc[~tripList['trip_mode'].isin([11,12,13]),:]
+
+    #Adding additional fields that are in TM2 trip list and setting them to zero
+    tripList['trip_board_tap'] = 0
+    tripList['trip_alight_tap'] = 0
+    tripList['set'] = -1
+    tripList['TRIP_TIME'] = 0
+    tripList['TRIP_DISTANCE'] = 0
+    tripList['TRIP_COST'] = 0
+
+    tripList = tripList.rename(columns=columnMap)
+    tripList = tripList[columnMap.values()]
+
+    ##Writing out TM2 trip list (the first chunk with the header, and the rest appended)
+    tripList.to_csv(outputTripFile, index=False, header=(chunkIndex == 0), mode=('w' if chunkIndex == 0 else 'a'))
+    print strftime("%Y-%m-%d %H:%M:%S"), ':Wrote the trips of %d input trips...' % inputRows
+print strftime("%Y-%m-%d %H:%M:%S"), ':Complete!'
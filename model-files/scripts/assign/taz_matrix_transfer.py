@@ -15,40 +15,63 @@
     The output of this will be a file for each in out_files (whose number must match those in in_files),
     using the sequential zone numbers. The output files must not be the same (name/location) as the 
     input files.
+
+    The files are streamed in chunks of lines (see renumber_columns.py), so memory use does not depend on the
+    matrix size. The zone columns of a chunk are renumbered together through the zone sequence lookup array,
+    and the rest of each line is copied as is; a zone that is not a taz in the zone sequence stops the transfer
+    (with a ValueError naming it). The file pairs are transferred concurrently, one per worker process (up to
+    one per processor).
     
     crf 2/2014
 """
 
 import os,sys
+import multiprocessing
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','common'))
+import renumber_columns
+import zone_sequence
+
+def sequenceTazs(zone_seq,zones):
+    """ Returns the sequential taz numbers of the taz nodes in the array zones. Raises ValueError if any of them
+    is not a taz (which the lookup maps to 0).
+    """
+    seqs = zone_seq.to_seq(zones,'TAZ')
+    unmapped = numpy.flatnonzero(seqs.ravel() == 0)
+    if len(unmapped) > 0:
+        raise ValueError('There are %d instances of unmapped taz nodes (the first is %d).' % (len(unmapped),zones.ravel()[unmapped[0]]))
+    return seqs
+
+def transferMatrix(task):
+    """ Transfers the matrix in in_file to the sequential taz numbering in out_file. task is
+    (zone_seq_file,in_file,out_file).
+    """
+    (zone_seq_file,in_file,out_file) = task
+    zone_seq = zone_sequence.ZoneSequence.read(zone_seq_file)
+    with open(in_file) as f:
+        with open(out_file,'wb') as of:
+            of.write(f.readline().strip() + os.linesep)
+            for chunk in renumber_columns.read_chunks(f):
+                of.write(renumber_columns.renumber_lines(chunk,lambda zones: sequenceTazs(zone_seq,zones)))
+    print 'transferred ' + in_file + ' to ' + out_file
+
+if __name__ == '__main__':
+    base_dir = sys.argv[1]
+    in_files = sys.argv[2].split(',')
+    out_files = sys.argv[3].split(',')
+
+    #first, create old->new mapping (and its cache, which the workers then read)
+    zone_seq_file = os.path.join(base_dir,'hwy','mtc_final_network_zone_seq.csv')
+    zone_sequence.ZoneSequence.read(zone_seq_file)
 
-base_dir = sys.argv[1]
-in_files = sys.argv[2].split(',')
-out_files = sys.argv[3].split(',')
-
-#first, create old->new mapping
-taz_mapping = {}
-with open(os.path.join(base_dir,'hwy','mtc_final_network_zone_seq.csv')) as f:
-    for line in f:
-        line = line.strip()
-        if len(line) == 0:
-            continue
-        data = line.split(',')
-        taz_mapping[int(data[0])] = int(data[1])
-
-#transfer the zone numberings
-for i in range(len(in_files)):
-    with open(os.path.join(base_dir,in_files[i])) as f:
-        with open(os.path.join(base_dir,out_files[i]),'wb') as of:
-            first = True
-            for line in f:
-                line = line.strip()
-                if first:
-                    of.write(line + os.linesep)
-                    first = False
-                    continue
-                if len(line) == 0:
-                    continue
-                data = line.split(',')
-                data[0] = str(taz_mapping[int(data[0])])
-                data[1] = str(taz_mapping[int(data[1])])
-                of.write(','.join(data) + os.linesep)
+    #transfer the zone numberings
+    tasks = [(zone_seq_file,os.path.join(base_dir,in_files[i]),os.path.join(base_dir,out_files[i])) for i in range(len(in_files))]
+    workers = min(len(tasks),multiprocessing.cpu_count())
+    if workers > 1:
+        pool = multiprocessing.Pool(processes=workers)
+        pool.map(transferMatrix,tasks)
+        pool.close()
+        pool.join()
+    else:
+        map(transferMatrix,tasks)
@@ -1,46 +1,92 @@
 """
-    transfer_maz_maz_vols.py base_dir period
-    
+    transfer_maz_maz_vols.py base_dir period [period ...]
+
     Transfer the maz->maz assignment volumes (used for preloading the taz->taz assignment) from
     the base network numbering to the assignment network's numbering.
-    
+
     Inputs: avgload@period@_taz_to_node.txt - base -> assignment network node correspondence
             maz_preload_@period@_vols.csv   - maz->maz assignment volumes
-            
+
     Outputs: maz_preload_@period@_seq_vols.csv   - maz->maz assignment volumes
-    
+
+    The periods are transferred concurrently, one per worker process (up to one per processor). For each
+    period, the node correspondence is read into a lookup array, and the volume file is streamed in chunks of
+    CHUNK_ROWS rows; the nodes of a chunk are looked up together, and links with a zero volume or an unmapped
+    node are dropped. The volumes are copied as they are written in the input; an empty or non-numeric volume
+    stops the transfer (with a ValueError naming its line), as it would stop the assignment.
+
     author: crf (2 2014)
 """
 
 import os,sys
+import multiprocessing
+import numpy, pandas
+
+CHUNK_ROWS = 1000000
+
+def readNodeCorrespondence(node_correspondence_file):
+    """ Reads the node correspondence file (whitespace separated N,OLD_NODE,...) into a lookup array, indexed by
+    base network node, of assignment network nodes (-1 if not mapped).
+    """
+    nodes = pandas.read_csv(node_correspondence_file,delim_whitespace=True,header=None,usecols=[0,1]).values
+    nodes = nodes.astype(numpy.int64)
+    table = numpy.zeros(nodes[:,1].max() + 1 if len(nodes) > 0 else 0,dtype=numpy.int64) - 1
+    table[nodes[:,1]] = nodes[:,0]
+    return table
+
+def mapNodes(table,nodes):
+    """ Returns the assignment network nodes of the (base network) nodes, -1 for those not mapped.
+    """
+    mapped = (nodes >= 0) & (nodes < len(table))
+    new_nodes = numpy.zeros(nodes.shape,dtype=numpy.int64) - 1
+    new_nodes[mapped] = table[nodes[mapped]]
+    return new_nodes
+
+def transferVolumes(task):
+    """ Transfers the maz->maz volumes of a period to the assignment network numbering. task is (base_dir,period).
+    """
+    (base_dir,period) = task
+    node_correspondence_file = os.path.join(base_dir,'hwy/avgload' + period + '_taz_to_node.txt')
+    maz_vols_file = os.path.join(base_dir,'hwy/maz_preload_' + period + '_vols.csv')
+    output_vols_file = os.path.join(base_dir,'hwy/maz_preload_' + period + '_seq_vols.csv')
+
+    table = readNodeCorrespondence(node_correspondence_file)
+    links = 0
+    lines = 0
+    with open(output_vols_file,'wb') as of:
+        #the volumes are read as text, so they are written as they are (without trailing whitespace)
+        for chunk in pandas.read_csv(maz_vols_file,header=None,usecols=[0,1,2],dtype={0:numpy.float64,1:numpy.float64,2:str},
+                                     chunksize=CHUNK_ROWS):
+            a = mapNodes(table,chunk[0].values.astype(numpy.int64))
+            b = mapNodes(table,chunk[1].values.astype(numpy.int64))
+            vol = chunk[2].values.astype(str)
+            #empty volumes are read as null, and (like any other non-numeric volume) have no float value
+            empty = chunk[2].isnull().values
+            vol_values = pandas.to_numeric(chunk[2],errors='coerce').values
+            invalid = numpy.flatnonzero(empty | numpy.isnan(vol_values))
+            if len(invalid) > 0:
+                raise ValueError('invalid %s maz->maz volume "%s" on line %d of %s' % (period,'(empty)' if empty[invalid[0]] else vol[invalid[0]],
+                                                                                      lines + invalid[0] + 1,maz_vols_file))
+            keep = (a >= 0) & (b >= 0) & (vol_values != 0.0)
+            vols = pandas.DataFrame({'A':a[keep],'B':b[keep],'VOL':numpy.char.rstrip(vol[keep])},columns=['A','B','VOL'])
+            vols.to_csv(of,header=False,index=False,line_terminator=os.linesep)
+            links += vols.shape[0]
+            lines += chunk.shape[0]
+    print 'transferred %d %s maz->maz volumes to %s' % (links,period,output_vols_file)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print __doc__
+        sys.exit(2)
+    base_dir = sys.argv[1]
+    periods = sys.argv[2:]
 
-base_dir = sys.argv[1]
-period = sys.argv[2]
-
-node_correspondence_file = os.path.join(base_dir,'hwy/avgload' + period + '_taz_to_node.txt')
-maz_vols_file = os.path.join(base_dir,'hwy/maz_preload_' + period + '_vols.csv')
-output_vols_file = os.path.join(base_dir,'hwy/maz_preload_' + period + '_seq_vols.csv')
-
-#read node correspondence
-node_correspondence = {}
-with open(node_correspondence_file) as f:
-    for line in f:
-        line = line.strip()
-        if len(line) == 0:
-            continue
-        line = line.split()
-        node_correspondence[int(float(line[1]))] = int(float(line[0]))
-    
-with open(output_vols_file,'wb') as of:
-    with open(maz_vols_file) as f:
-        for line in f:
-            line = line.strip()
-            if len(line) == 0:
-                continue
-            line = line.split(',')
-            a = int(float(line[0]))
-            b = int(float(line[1]))
-            vol = float(line[2])
-            if (not a in node_correspondence) or (not b in node_correspondence) or (vol == 0.0):
-                continue
-            of.write(','.join(map(str,(node_correspondence[a],node_correspondence[b],line[2]))) + os.linesep)
+    tasks = [(base_dir,period) for period in periods]
+    workers = min(len(tasks),multiprocessing.cpu_count())
+    if workers > 1:
+        pool = multiprocessing.Pool(processes=workers)
+        pool.map(transferVolumes,tasks)
+        pool.close()
+        pool.join()
+    else:
+        map(transferVolumes,tasks)
@@ -0,0 +1,21 @@
+"""
+    file_cache.py
+
+    Helpers shared by the scripts that keep derived (binary) caches of their input files, and reuse them
+    for as long as the inputs are unchanged (see zone_sequence.py, zone_data.py, transit_line_file.py, etc.).
+    A cache is keyed by the hashes of the files it is built from:
+
+        key = ','.join([str(CACHE_VERSION),hash_file(input_file)])
+
+"""
+
+import hashlib
+
+def hash_file(file_name):
+    """ Returns the md5 hex digest of the contents of file_name.
+    """
+    md5 = hashlib.md5()
+    with open(file_name,'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20),''):
+            md5.update(chunk)
+    return md5.hexdigest()
@@ -0,0 +1,153 @@
+"""
+    renumber_columns.py
+
+    Renumbering of the first two (integer) columns of csv text, such as the zones of a matrix file or the a/b
+    nodes of a link file, shared by the scripts that transfer files between numbering schemes.
+
+    Files are read in chunks of whole lines (read_chunks), and each chunk is renumbered as a block of bytes
+    (renumber_lines): the line extents and the first two fields are found with array operations, the fields
+    are parsed and renumbered together, and the rest of every line is copied as bytes, never parsed. For
+    example:
+
+        with open(in_file) as f:
+            with open(out_file,'wb') as of:
+                for chunk in read_chunks(f):
+                    of.write(renumber_lines(chunk,lambda numbers: table[numbers]))
+
+"""
+
+import os
+import numpy
+
+CHUNK_BYTES = 1 << 24
+#bytes stripped from (and so not allowed within) the number fields and the ends of lines, as by str.strip
+WHITESPACE = numpy.zeros(256,dtype=bool)
+WHITESPACE[[ord(c) for c in ' \t\r\n\x0b\x0c']] = True
+
+def read_chunks(f,chunk_bytes=CHUNK_BYTES):
+    """ Yields the rest of the (text) file f in chunks of whole lines, of about chunk_bytes each; every chunk
+    ends with a newline.
+    """
+    while True:
+        chunk = f.read(chunk_bytes)
+        if len(chunk) == 0:
+            return
+        if not chunk.endswith('\n'):
+            chunk += f.readline()
+        if not chunk.endswith('\n'):
+            chunk += '\n'
+        yield chunk
+
+def parse_ints(buf,starts,stops):
+    """ Parses the integers, each with an optional sign, in the byte ranges [starts[i],stops[i]) of buf, which may
+    be padded with whitespace (but not contain any, so "1 2" is an error). The (short) fields are read a
+    character position at a time, all together.
+    """
+    values = numpy.zeros(len(starts),dtype=numpy.int64)
+    negative = numpy.zeros(len(starts),dtype=bool)
+    found = numpy.zeros(len(starts),dtype=bool)
+    started = numpy.zeros(len(starts),dtype=bool) #a sign or digit has been read
+    ended = numpy.zeros(len(starts),dtype=bool) #whitespace has been read after the number
+    lengths = stops - starts
+    fields = numpy.arange(len(starts))
+    position = 0
+    while len(fields) > 0:
+        fields = fields[lengths[fields] > position]
+        chars = buf[starts[fields] + position]
+        digit = (chars >= ord('0')) & (chars <= ord('9'))
+        sign = (chars == ord('-')) | (chars == ord('+'))
+        space = WHITESPACE[chars]
+        if not ((digit & ~ended[fields]) | (sign & ~started[fields]) | space).all():
+            raise ValueError('invalid number in column')
+        ended[fields[space & started[fields]]] = True
+        started[fields[digit | sign]] = True
+        negative[fields[chars == ord('-')]] = True
+        values[fields[digit]] = values[fields[digit]]*10 + (chars[digit] - ord('0'))
+        found[fields[digit]] = True
+        position += 1
+    if not found.all():
+        raise ValueError('invalid number in column')
+    return numpy.where(negative,-values,values)
+
+def digit_counts(values):
+    """ Returns the number of (decimal) digits in each of the non-negative (int32) values.
+    """
+    counts = numpy.ones(len(values),dtype=numpy.int64)
+    for power in range(1,10):
+        counts += values >= 10**power
+    return counts
+
+def range_mask(size,starts,stops):
+    """ Returns a boolean array of length size marking the (ordered, non-overlapping) ranges [starts[i],stops[i]).
+    """
+    marks = numpy.zeros(size + 1,dtype=numpy.int8)
+    marks[starts] += 1
+    marks[stops] -= 1
+    return numpy.cumsum(marks[:-1],dtype=numpy.int8) > 0
+
+def renumber_lines(chunk,renumber,keep_short=False):
+    """ Renumbers the first two columns of the csv lines in chunk (which ends with a newline), returning the
+    text of the renumbered lines, each ending with os.linesep. Lines are stripped of surrounding whitespace.
+
+    renumber is called with the (lines x 2) int64 array of the numbers in the first two columns, and returns
+    the new (non-negative) numbers. Each line is written as the two new numbers followed by the rest of the
+    input line (from its second comma, if any).
+
+    Lines without a comma (including blank lines) are an error, unless keep_short is set, in which case they
+    are copied (stripped); blank lines are dropped if keep_short is not set.
+    """
+    buf = numpy.frombuffer(chunk,dtype=numpy.uint8)
+    #line extents, stripped (a step at a time, as there is rarely more than a \r to strip)
+    ends = numpy.flatnonzero(buf == ord('\n'))
+    starts = numpy.concatenate(([0],ends[:-1] + 1))
+    strip = numpy.arange(len(starts))
+    while len(strip) > 0:
+        strip = strip[(starts[strip] < ends[strip]) & WHITESPACE[buf[starts[strip]]]]
+        starts[strip] += 1
+    strip = numpy.arange(len(ends))
+    while len(strip) > 0:
+        strip = strip[(starts[strip] < ends[strip]) & WHITESPACE[buf[ends[strip] - 1]]]
+        ends[strip] -= 1
+    if not keep_short:
+        keep = starts < ends
+        (starts,ends) = (starts[keep],ends[keep])
+    if len(starts) == 0:
+        return ''
+    #the numbers are the first two fields
+    commas = numpy.append(numpy.flatnonzero(buf == ord(',')),len(buf))
+    comma = numpy.searchsorted(commas,starts)
+    numbered = commas[comma] < ends
+    if not (keep_short or numbered.all()):
+        raise ValueError('line without two number columns')
+    first_comma = commas[comma[numbered]]
+    second_comma = numpy.minimum(commas[comma[numbered] + 1],ends[numbered])
+    numbers = numpy.column_stack((parse_ints(buf,starts[numbered],first_comma),
+                                  parse_ints(buf,first_comma + 1,second_comma)))
+    numbers = numpy.asarray(renumber(numbers),dtype=numpy.int64)
+
+    #new text of each line: number,number (head; none for short lines), the rest of the line, the line separator
+    digits = numpy.zeros((len(starts),2),dtype=numpy.int64)
+    digits[numbered] = numpy.column_stack((digit_counts(numbers[:,0]),digit_counts(numbers[:,1])))
+    head = numpy.where(numbered,digits[:,0] + 1 + digits[:,1],0)
+    rest_starts = starts.copy()
+    rest_starts[numbered] = second_comma
+    rest = ends - rest_starts
+    lengths = head + rest + len(os.linesep)
+    offsets = numpy.cumsum(lengths) - lengths
+    #the head and line separator bytes, in order
+    added = numpy.empty((lengths - rest).sum(),dtype=numpy.uint8)
+    added_offsets = (numpy.cumsum(lengths - rest) - (lengths - rest))
+    (digits,numbered_offsets) = (digits[numbered],added_offsets[numbered])
+    for (column,column_offsets) in ((0,numbered_offsets),(1,numbered_offsets + digits[:,0] + 1)):
+        for digit in range(digits[:,column].max() if len(digits) > 0 else 0):
+            has_digit = digit < digits[:,column]
+            power = digits[has_digit,column] - digit - 1
+            added[column_offsets[has_digit] + digit] = (numbers[has_digit,column] // 10**power) % 10 + ord('0')
+    added[numbered_offsets + digits[:,0]] = ord(',')
+    for i in range(len(os.linesep)):
+        added[added_offsets + head + i] = ord(os.linesep[i])
+    out = numpy.empty(lengths.sum(),dtype=numpy.uint8)
+    moved = range_mask(len(out),offsets + head,offsets + head + rest)
+    out[moved] = buf[range_mask(len(buf),rest_starts,ends)]
+    out[~moved] = added
+    return out.tostring()
@@ -0,0 +1,154 @@
+"""
+    transit_line_file.py
+
+    Reader for Cube transit line files (trn\transitLines.lin), shared by the transit scripts. Each line
+    record is expected on a single line of the file, e.g.:
+
+        LINE NAME="EM_HOLLIS", USERA1="Emery Go-Round", USERA2="Local bus", MODE=12, ONEWAY=T, XYSPEED=15,
+             HEADWAY[1]=60.0, HEADWAY[2]=12.0, HEADWAY[3]=20.0, HEADWAY[4]=12.0, HEADWAY[5]=30.0, N=2565595,...
+
+    and lines with fewer than three fields (comments, etc.) are skipped. The file is parsed once into a
+    TransitLineFile, which holds:
+
+        names    - the line names (quotes removed)
+        modes    - the USERA2 mode of each line (quotes removed)
+        headways - (line x period) float array of HEADWAY[1..5]
+        nodes    - flat int32 array of every line's node sequence; negative nodes are pass-through nodes
+        offsets  - int64 array such that line i's nodes are nodes[offsets[i]:offsets[i+1]]
+
+    The arrays are saved to a binary cache (line_file + '.npz') which is used instead of parsing the text
+    file for as long as the size and md5 hash of the line file are unchanged.
+
+    Usage:
+
+        lines = TransitLineFile.read(r'trn\transitLines.lin')
+        stop_nodes = lines.stops('AM','LOCAL_BUS')       # stop nodes of lines running in the AM period
+        (stop_nodes,line_index) = lines.stop_incidence() # unique (stop node, line) pairs
+
+"""
+
+import os,re
+import numpy
+
+import file_cache
+
+PERIODS = ['EA','AM','MD','PM','EV'] #HEADWAY[1] .. HEADWAY[5]
+CACHE_VERSION = 2 #2: malformed node sequences are rejected, so older caches may hold truncated ones
+
+NODES_PATTERN = re.compile(r'(^|,)\s*N\s*=')
+
+def normalize_mode(mode):
+    """ Returns the mode key used by the scripts for a USERA2 value, e.g. "Local bus" -> LOCAL_BUS.
+    """
+    return mode.replace('"','').upper().replace(' ','_')
+
+class TransitLineFile(object):
+    """ Array-backed contents of a transit line file.
+    """
+
+    def __init__(self,names,modes,headways,nodes,offsets):
+        self.names    = list(names)
+        self.modes    = list(modes)
+        self.headways = headways
+        self.nodes    = nodes
+        self.offsets  = offsets
+        #line index of each entry in nodes
+        self.node_lines = numpy.repeat(numpy.arange(len(self.names),dtype=numpy.int32),numpy.diff(offsets))
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def read(cls,line_file,use_cache=True):
+        """ Reads line_file, using (and refreshing) its binary cache if use_cache is set.
+        """
+        if not use_cache:
+            return cls.parse(line_file)
+        cache_file = line_file + '.npz'
+        size = os.path.getsize(line_file)
+        md5 = file_cache.hash_file(line_file)
+        if os.path.exists(cache_file):
+            cache = numpy.load(cache_file)
+            if (int(cache['version']) == CACHE_VERSION) and (int(cache['size']) == size) and (str(cache['md5']) == md5):
+                return cls(cache['names'].tolist(),cache['modes'].tolist(),cache['headways'],cache['nodes'],cache['offsets'])
+        lines = cls.parse(line_file)
+        try:
+            numpy.savez(cache_file,version=CACHE_VERSION,size=size,md5=md5,names=numpy.array(lines.names,dtype=str),
+                        modes=numpy.array(lines.modes,dtype=str),headways=lines.headways,nodes=lines.nodes,
+                        offsets=lines.offsets)
+        except (IOError,OSError):
+            print 'could not write transit line cache ' + cache_file
+        return lines
+
+    @classmethod
+    def parse(cls,line_file):
+        """ Parses the text line file. The fields before N= are split out as before; the node sequence itself
+        is converted in one call rather than token by token. A node sequence with a token that is not a number
+        raises ValueError.
+        """
+        names = []
+        modes = []
+        headways = []
+        node_sequences = []
+        for line in open(line_file):
+            line = line.strip()
+            match = NODES_PATTERN.search(line)
+            if match is None:
+                continue
+            split_line = map(str.strip,re.split('[=,]',line[:match.start()]))
+            if len(split_line) < 2:
+                continue
+            names.append(split_line[1].replace('"',''))
+            modes.append(split_line[split_line.index('USERA2') + 1].replace('"',''))
+            headways.append([float(split_line[split_line.index('HEADWAY[' + str(i+1) + ']') + 1]) for i in range(len(PERIODS))])
+            sequence = line[match.end():].strip().strip(',')
+            nodes = numpy.fromstring(sequence,dtype=numpy.int32,sep=',')
+            #fromstring stops at the first token it cannot parse, so a short result is a malformed sequence
+            if len(nodes) != (sequence.count(',') + 1 if len(sequence) > 0 else 0):
+                raise ValueError('invalid node sequence for line ' + names[-1] + ' in ' + line_file)
+            node_sequences.append(nodes)
+        offsets = numpy.zeros(len(names) + 1,dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(sequence) for sequence in node_sequences])
+        if len(node_sequences) > 0:
+            nodes = numpy.concatenate(node_sequences)
+        else:
+            nodes = numpy.zeros(0,dtype=numpy.int32)
+        return cls(names,modes,numpy.array(headways,dtype=numpy.float64).reshape(len(names),len(PERIODS)),nodes,offsets)
+
+    def line_nodes(self,line_index):
+        """ Returns the node sequence (with pass-through nodes negative) of a line.
+        """
+        return self.nodes[self.offsets[line_index]:self.offsets[line_index + 1]]
+
+    def lines(self,period=None,mode=None):
+        """ Returns the indices of the lines running in period (a HEADWAY > 0) and of mode (normalized, see
+        normalize_mode); either may be None to not filter on it.
+        """
+        keep = numpy.ones(len(self.names),dtype=bool)
+        if period is not None:
+            keep &= self.headways[:,PERIODS.index(period)] > 0.0
+        if mode is not None:
+            keep &= numpy.array([normalize_mode(line_mode) == normalize_mode(mode) for line_mode in self.modes],dtype=bool)
+        return numpy.nonzero(keep)[0]
+
+    def stops(self,period=None,mode=None):
+        """ Returns the (sorted, unique) stop nodes of the lines selected as in lines(period,mode).
+        """
+        served = numpy.zeros(len(self.names),dtype=bool)
+        served[self.lines(period,mode)] = True
+        return numpy.unique(self.nodes[served[self.node_lines] & (self.nodes > 0)])
+
+    def stop_incidence(self):
+        """ Returns (stop_nodes,line_index) arrays holding each unique (stop node, line) pair.
+        """
+        stop = self.nodes > 0
+        pairs = numpy.unique(self.nodes[stop].astype(numpy.int64)*len(self.names) + self.node_lines[stop])
+        return (pairs // len(self.names)).astype(numpy.int32),(pairs % len(self.names)).astype(numpy.int32)
+
+    def lines_by_node(self):
+        """ Returns a dict mapping each stop node to the list of indices of the lines stopping there.
+        """
+        lines_by_node = {}
+        for (node,line_index) in zip(*self.stop_incidence()):
+            lines_by_node.setdefault(node,[]).append(line_index)
+        return lines_by_node
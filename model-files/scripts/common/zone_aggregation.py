@@ -0,0 +1,93 @@
+"""
+    zone_aggregation.py
+
+    Aggregation of zone (maz) data columns into categories, shared by the scripts that roll the land use data
+    up into employment/size term categories. A category scheme is an OrderedDict mapping each category
+    (target column) to the list of source columns summed into it, e.g.
+
+        categories = OrderedDict([('RETEMPN',['emp_retail']),
+                                  ('FPSEMPN',['emp_prof_bus_svcs','emp_personal_svcs_office']),
+                                  ('AGE0519',[])])
+
+    A source column may be used in any number of categories, and a category with no source columns is zero.
+    The categories are computed together, with one sparse product, from the (zone x source column) block of
+    values, and are optionally grouped to any geography given by a key (e.g. TAZ) for each zone:
+
+        maz_data = zone_data.read_columns(r'landuse\maz_data.csv',['TAZ'] + source_columns(categories))
+        maz_totals = aggregate(maz_data,categories)
+        (tazs,taz_totals) = aggregate(maz_data,categories,maz_data['TAZ'])
+
+    The product matrix is the Kronecker product of the (group x zone) grouping matrix and the (category x source
+    column) selection matrix, applied to the block flattened in row order; its row group*len(categories) + category
+    holds the totals of a category in a group. It is built directly from the two matrices, with the entries of each
+    row ordered so that each sum is taken zone by zone (in row order) and, within a zone, in the order the source
+    columns are listed; the totals are therefore exactly those of summing the listed columns of each row in turn.
+
+"""
+
+import collections
+import numpy
+import scipy.sparse
+
+def source_columns(categories):
+    """ Returns the source columns of the categories, in the order they are first listed.
+    """
+    columns = []
+    for sources in categories.values():
+        columns.extend(column for column in sources if column not in columns)
+    return columns
+
+def selection_matrix(categories):
+    """ Returns the source columns (see source_columns), and the (category x source column) sparse indicator
+    matrix of the columns summed into each category, with the entries of each category in the order they are listed.
+    """
+    columns = source_columns(categories)
+    indices = numpy.array([columns.index(column) for sources in categories.values() for column in sources],dtype=numpy.int64)
+    indptr = numpy.concatenate(([0],numpy.cumsum([len(sources) for sources in categories.values()]))).astype(numpy.int64)
+    return (columns,scipy.sparse.csr_matrix((numpy.ones(len(indices)),indices,indptr),shape=(len(categories),len(columns))))
+
+def grouping_matrix(keys):
+    """ Returns the sorted distinct keys (the groups), and the (group x zone) sparse indicator matrix of the
+    zones (positions in keys) in each group, with the zones of each group in order.
+    """
+    keys = numpy.asarray(keys)
+    (groups,group) = numpy.unique(keys,return_inverse=True)
+    return (groups,scipy.sparse.csr_matrix((numpy.ones(len(keys)),(group,numpy.arange(len(keys)))),shape=(len(groups),len(keys))))
+
+def product_matrix(grouping,selection):
+    """ Returns the Kronecker product of the grouping and selection matrices (see above), as a sparse matrix whose
+    row g*categories + c has the entries of the zones of group g (in the grouping's order), each with the source
+    columns of category c (in the selection's order).
+    """
+    (zones_ptr,zones) = (grouping.indptr.astype(numpy.int64),grouping.indices.astype(numpy.int64))
+    (sources_ptr,sources) = (selection.indptr.astype(numpy.int64),selection.indices.astype(numpy.int64))
+    (categories,columns) = selection.shape
+    zone_counts = numpy.diff(zones_ptr)
+    source_counts = numpy.diff(sources_ptr)
+    row_ptr = numpy.concatenate(([0],numpy.cumsum((zone_counts[:,None]*source_counts[None,:]).ravel())))
+    #each entry's row (g,c), and its position (zone of g, then source of c) in the row
+    row = numpy.repeat(numpy.arange(len(row_ptr) - 1),numpy.diff(row_ptr))
+    (g,c) = (row // categories,row % categories)
+    position = numpy.arange(len(row)) - row_ptr[row]
+    zone = zones[zones_ptr[g] + position // source_counts[c]]
+    source = sources[sources_ptr[c] + position % source_counts[c]]
+    return scipy.sparse.csr_matrix((numpy.ones(len(row)),zone*columns + source,row_ptr),
+                                   shape=(grouping.shape[0]*categories,grouping.shape[1]*columns))
+
+def aggregate(values,categories,keys=None):
+    """ Returns an OrderedDict mapping each category to its (float64) totals: by zone, or, if keys (the key of
+    each zone) is given, by group, in which case the sorted distinct keys are returned with them (as a tuple).
+    values maps each source column to its values (e.g. an OrderedDict from zone_data.read_columns, or a
+    DataFrame); a missing source column raises a KeyError.
+    """
+    (columns,selection) = selection_matrix(categories)
+    block = [numpy.asarray(values[column],dtype=numpy.float64) for column in columns]
+    zones = len(keys) if keys is not None else (len(block[0]) if len(block) > 0 else 0)
+    block = numpy.column_stack(block) if len(block) > 0 else numpy.zeros((zones,0))
+    if keys is None:
+        (groups,grouping) = (None,scipy.sparse.identity(zones,format='csr'))
+    else:
+        (groups,grouping) = grouping_matrix(keys)
+    totals = product_matrix(grouping,selection).dot(block.ravel()).reshape(grouping.shape[0],len(categories))
+    totals = collections.OrderedDict((category,numpy.ascontiguousarray(totals[:,i])) for (i,category) in enumerate(categories))
+    return totals if keys is None else (groups,totals)
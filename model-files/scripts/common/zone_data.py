@@ -0,0 +1,139 @@
+"""
+    zone_data.py
+
+    Reader for the zone (land use) data files, chiefly landuse\maz_data.csv, shared by the scripts that read
+    them. The csv file is parsed once, into a typed, columnar binary cache; later reads load only the columns
+    they ask for, memory-mapped, from the cache:
+
+        maz_data = zone_data.read_columns(r'landuse\maz_data.csv',['MAZ_ORIGINAL','TAZ_ORIGINAL','HH'])
+        maz_df = zone_data.read_frame(r'landuse\maz_data.csv',['MAZ','POP','ACRES'],upcast=True)
+
+    The cache is the directory data_file + '.cache', holding each column as a .npy file (named by the column's
+    position), the column names (columns.txt) and a key (key.txt). The columns are stored as
+
+        int32   - integer columns (int64 if any value does not fit)
+        float32 - real columns whose values are all exactly float32 values (float64 otherwise)
+        strings - any other (text) columns
+
+    so the cached values are exactly those of the csv file. The key holds the size, modification time and md5
+    hash of the csv file: the cache is used while the size and modification time are unchanged, or, if only the
+    modification time has changed, while the hash is unchanged.
+
+"""
+
+import collections,os
+import numpy, pandas
+
+import file_cache
+
+CACHE_VERSION = 1
+
+def cache_dir(data_file):
+    """ Returns the directory holding the cache of data_file.
+    """
+    return data_file + '.cache'
+
+def narrow(values):
+    """ Returns the (parsed) column values as stored in the cache: as int32/float32 if that loses nothing.
+    """
+    kind = values.dtype.kind
+    if kind in 'iu':
+        info = numpy.iinfo(numpy.int32)
+        if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return values.astype(numpy.int32)
+        return values.astype(numpy.int64)
+    if kind == 'f':
+        narrowed = values.astype(numpy.float32)
+        if ((narrowed == values) | numpy.isnan(values)).all():
+            return narrowed
+        return values.astype(numpy.float64)
+    if kind == 'b':
+        return values
+    return values.astype(str)
+
+def widen(values):
+    """ Returns a copy of the (cached) column values as int64/float64.
+    """
+    kind = values.dtype.kind
+    if kind in 'iu':
+        return values.astype(numpy.int64)
+    if kind == 'f':
+        return values.astype(numpy.float64)
+    return numpy.array(values)
+
+def parse(data_file):
+    """ Parses the csv file, returning an OrderedDict mapping each column name to its (narrowed) values.
+    """
+    dframe = pandas.read_csv(data_file,skipinitialspace=True,float_precision='round_trip')
+    return collections.OrderedDict((column,narrow(dframe[column].values)) for column in dframe.columns.values)
+
+def cached_columns(data_file):
+    """ Returns the column names in the cache of data_file if the cache is valid, and otherwise None. If only the
+    modification time of data_file has changed (and not its contents), the key is updated.
+    """
+    cache = cache_dir(data_file)
+    key_file = os.path.join(cache,'key.txt')
+    if not os.path.exists(key_file):
+        return None
+    key = open(key_file).read().split(',')
+    if key[:2] != [str(CACHE_VERSION),str(os.path.getsize(data_file))]:
+        return None
+    if key[2] != repr(os.path.getmtime(data_file)):
+        if key[3] != file_cache.hash_file(data_file):
+            return None
+        try:
+            with open(key_file,'wb') as f:
+                f.write(','.join(key[:2] + [repr(os.path.getmtime(data_file)),key[3]]))
+        except (IOError,OSError):
+            pass
+    return open(os.path.join(cache,'columns.txt')).read().splitlines()
+
+def write_cache(data_file,data):
+    """ Writes the columns of data_file (as returned by parse) to its cache.
+    """
+    cache = cache_dir(data_file)
+    key_file = os.path.join(cache,'key.txt')
+    key = ','.join(map(str,[CACHE_VERSION,os.path.getsize(data_file)]) +
+                   [repr(os.path.getmtime(data_file)),file_cache.hash_file(data_file)])
+    try:
+        if not os.path.exists(cache):
+            os.makedirs(cache)
+        #the key is removed first and written last, so an interrupted write leaves the cache invalid
+        if os.path.exists(key_file):
+            os.remove(key_file)
+        for (i,values) in enumerate(data.values()):
+            numpy.save(os.path.join(cache,'%d.npy' % i),values)
+        with open(os.path.join(cache,'columns.txt'),'wb') as f:
+            f.write(''.join(column + '\n' for column in data))
+        with open(key_file,'wb') as f:
+            f.write(key)
+    except (IOError,OSError):
+        print 'could not write zone data cache ' + cache
+
+def read_columns(data_file,columns=None,use_cache=True,upcast=False):
+    """ Returns an OrderedDict mapping the requested columns (all, in file order, if columns is None) of data_file
+    to their values. The values are the (read-only, memory-mapped) cached arrays, unless upcast is set, in which
+    case they are int64/float64 copies. The cache is built (or refreshed) if use_cache is set and it is not valid.
+    A requested column that is not in the file raises a KeyError.
+    """
+    names = cached_columns(data_file) if use_cache else None
+    if names is None:
+        data = parse(data_file)
+        if use_cache:
+            write_cache(data_file,data)
+        names = list(data.keys())
+        load = lambda i: data[names[i]]
+    else:
+        load = lambda i: numpy.load(os.path.join(cache_dir(data_file),'%d.npy' % i),mmap_mode='r')
+    values = collections.OrderedDict()
+    for column in (names if columns is None else columns):
+        if not column in names:
+            raise KeyError('column %s not in %s' % (column,data_file))
+        values[column] = widen(load(names.index(column))) if upcast else load(names.index(column))
+    return values
+
+def read_frame(data_file,columns=None,use_cache=True,upcast=False):
+    """ Returns the requested columns of data_file as a DataFrame; see read_columns.
+    """
+    values = read_columns(data_file,columns,use_cache,upcast)
+    return pandas.DataFrame(values,columns=list(values.keys()))
@@ -0,0 +1,124 @@
+"""
+    zone_sequence.py
+
+    Reader for the network zone sequence correspondence (hwy\mtc_final_network_zone_seq.csv), shared by the
+    scripts that renumber zones. The file (see zone_seq_net_builder.job) has the columns:
+
+        N,TAZSEQ,MAZSEQ,TAPSEQ,EXTSEQ
+
+    where N is the (CUBE) network node and each XXXSEQ is the (CTRAMP) sequential number of the node if it is
+    a zone of that kind, and 0 otherwise. The header line is optional.
+
+    The file is read into a ZoneSequence, which holds two dense int32 lookup arrays:
+
+        node_to_seq - (kind x node) array; node_to_seq[k,n] is the sequential number of node n (0 if n is not
+                      a zone of kind k); its columns run up to the largest zone node
+        seq_to_node - (kind x seq) array; seq_to_node[k,s] is the node with sequential number s (0 if none)
+
+    with the kinds in the order of KINDS, so renumbering an array of zones is a single fancy-index operation:
+
+        zone_seq = ZoneSequence.read(r'hwy\mtc_final_network_zone_seq.csv')
+        taz_seqs = zone_seq.to_seq(taz_nodes,'TAZ')
+        taz_nodes = zone_seq.to_node(taz_seqs,'TAZ')
+
+    node_to_seq is saved to a binary cache (zone_seq_file + '.npy', with its key in zone_seq_file + '.npy.key')
+    which is used, memory-mapped, instead of the csv file for as long as the size and md5 hash of the csv file
+    are unchanged.
+
+"""
+
+import os
+import numpy, pandas
+
+import file_cache
+
+KINDS = ['TAZ','MAZ','TAP','EXT']
+COLUMNS = ['N'] + [kind + 'SEQ' for kind in KINDS]
+CACHE_VERSION = 1
+
+class ZoneSequence(object):
+    """ Array-backed node <-> sequential zone number correspondence.
+    """
+
+    def __init__(self,node_to_seq):
+        self.node_to_seq = node_to_seq
+        self.seq_to_node = numpy.zeros((len(KINDS),node_to_seq.max() + 1 if node_to_seq.size > 0 else 1),dtype=numpy.int32)
+        for k in range(len(KINDS)):
+            nodes = numpy.nonzero(node_to_seq[k])[0]
+            self.seq_to_node[k,node_to_seq[k,nodes]] = nodes
+
+    @classmethod
+    def read(cls,zone_seq_file,use_cache=True):
+        """ Reads zone_seq_file, using (and refreshing) its binary cache if use_cache is set.
+        """
+        if not use_cache:
+            return cls.parse(zone_seq_file)
+        cache_file = zone_seq_file + '.npy'
+        key_file = cache_file + '.key'
+        key = ','.join(map(str,[CACHE_VERSION,os.path.getsize(zone_seq_file),file_cache.hash_file(zone_seq_file)]))
+        if os.path.exists(cache_file) and os.path.exists(key_file) and open(key_file).read() == key:
+            return cls(numpy.load(cache_file,mmap_mode='r'))
+        zone_seq = cls.parse(zone_seq_file)
+        try:
+            numpy.save(cache_file,zone_seq.node_to_seq)
+            #the key is written last, so an interrupted write leaves the cache invalid
+            with open(key_file,'wb') as f:
+                f.write(key)
+        except (IOError,OSError):
+            print 'could not write zone sequence cache ' + cache_file
+        return zone_seq
+
+    @classmethod
+    def parse(cls,zone_seq_file):
+        """ Parses the csv file. The columns are taken from the header if there is one, and are otherwise
+        assumed to be in the order of COLUMNS.
+        """
+        with open(zone_seq_file) as f:
+            first = [field.strip().replace('"','') for field in f.readline().split(',')]
+        has_header = not first[0].lstrip('-').isdigit()
+        data = pandas.read_csv(zone_seq_file,header=None,skiprows=1 if has_header else 0,skipinitialspace=True,
+                               dtype=numpy.int64).values
+        columns = first if has_header else COLUMNS
+        nodes = data[:,columns.index('N')]
+        seqs = data[:,[columns.index(column) for column in COLUMNS[1:]]]
+        zones = numpy.nonzero((seqs > 0).any(axis=1))[0]
+        node_to_seq = numpy.zeros((len(KINDS),nodes[zones].max() + 1 if len(zones) > 0 else 1),dtype=numpy.int32)
+        node_to_seq[:,nodes[zones]] = seqs[zones].T
+        return cls(node_to_seq)
+
+    def count(self,kind):
+        """ Returns the number of zones (the largest sequential number) of kind.
+        """
+        return int(self.node_to_seq[KINDS.index(kind)].max())
+
+    def nodes(self,kind):
+        """ Returns the nodes of the zones of kind, in sequential number order.
+        """
+        return numpy.array(self.seq_to_node[KINDS.index(kind),1:self.count(kind) + 1])
+
+    def to_seq(self,nodes,kind):
+        """ Returns the sequential numbers (as kind) of the nodes in the array nodes; 0 for nodes that are not
+        zones of that kind.
+        """
+        return lookup(self.node_to_seq[KINDS.index(kind)],nodes)
+
+    def to_node(self,seqs,kind):
+        """ Returns the nodes of the sequential numbers (of kind) in the array seqs; 0 for numbers with no zone.
+        """
+        return lookup(self.seq_to_node[KINDS.index(kind)],seqs)
+
+    def mapping(self,kind):
+        """ Returns a dict mapping each node of kind to its sequential number.
+        """
+        node_to_seq = self.node_to_seq[KINDS.index(kind)]
+        nodes = numpy.nonzero(node_to_seq)[0]
+        return dict(zip(nodes.tolist(),node_to_seq[nodes].tolist()))
+
+def lookup(table,keys):
+    """ Returns table[keys] for an array (or scalar) of keys, with 0 for keys outside of table.
+    """
+    keys = numpy.asarray(keys,dtype=numpy.int64)
+    inside = (keys >= 0) & (keys < len(table))
+    values = numpy.zeros(keys.shape,dtype=numpy.int32)
+    values[inside] = table[keys[inside]]
+    return values
@@ -61,6 +61,11 @@
     Additionally, the ***not used*** classes are ignored, as these represent dollar counts,
     not employment
 
+    The aggregation is one sparse product of the maz->taz indicator (grouping) matrix and the column selection
+    matrix built from data_map, applied to the maz data (see zone_aggregation.py); the reallocation is done for all
+    tazs at once with array operations, and the file is written in one call. The sums and roundings are done in
+    the same order as the original row by row version, so the output is unchanged.
+
     Inputs: maz_data.csv - the input maz data file
 
     Outputs: truck_taz_data.csv - the output truck taz data file
@@ -69,7 +74,12 @@
     authors:  crf (2014 2 7)
 """
 
-import sys,os,csv
+import collections,sys,os
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','common'))
+import zone_aggregation
+import zone_data
 
 base_dir = sys.argv[1]
 maz_data_file = os.path.join(base_dir,sys.argv[2])
@@ -120,61 +130,44 @@ data_map['***not used***'] = ['emp_scrap_other',
 data_map['PE'] =             ['emp_self',
                               'emp_own_occ_dwell_mgmt']
 
-#read in maz-level employment data, and aggregate it to taz-level
-taz_data = {}
-taz_data[0] = {} #for default
-for column in data_map:
-    taz_data[0][column] = 0.0
-with open(maz_data_file) as f:
-    for row in csv.DictReader(f,skipinitialspace=True):
-        taz = int(row['TAZ'])
-        if not taz in taz_data:
-            taz_data[taz] = {}
-            for column in data_map:
-                taz_data[taz][column] = 0.0
-        for column in data_map:
-            for maz_column in data_map[column]:
-                taz_data[taz][column] += float(row[maz_column])
+#read in maz-level employment data, and aggregate it to taz-level (the ***not used*** classes are left out)
+sum_columns = [column for column in data_map if column != '***not used***']
+categories = collections.OrderedDict((column,data_map[column]) for column in sum_columns)
+maz_data = zone_data.read_columns(maz_data_file,['TAZ'] + zone_aggregation.source_columns(categories),upcast=True)
+(tazs,emps) = zone_aggregation.aggregate(maz_data,categories,maz_data['TAZ'].astype(numpy.int64))
+zones = len(tazs)
 
 #reallocate PE
 default_fraction = 1 / float(len(allocation_columns))
-for taz in taz_data:
-    emps = taz_data[taz]
-    emp_sum = 0.0
-    max_column = None #max column gets remainder
-    for column in allocation_columns:
-        emp_sum += emps[column]
-        if max_column is None:
-            max_column = column
-        elif emps[column] > emps[max_column]:
-            max_column = column
-
-    allocations_fractions = {}
-    for column in allocation_columns:
-        if emp_sum == 0:
-            allocations_fractions[column] = default_fraction
-        else:
-            allocations_fractions[column] = emps[column] / emp_sum
-
-    allocated_total = 0
-    for column in allocation_columns:
-        if column == max_column:
-            continue
-        allocation_emp = round(allocations_fractions[column] * emps['PE'])
-        emps[column] += allocation_emp
-        allocated_total += allocation_emp
-    emps[max_column] += max(0,emps['PE'] - allocated_total)
+allocations = numpy.column_stack([emps[column] for column in allocation_columns])
+emp_sum = numpy.zeros(zones)
+for column in allocation_columns:
+    emp_sum += emps[column]
+max_column = numpy.argmax(allocations,axis=1) #max column gets remainder
+with numpy.errstate(divide='ignore',invalid='ignore'):
+    allocations_fractions = numpy.where((emp_sum == 0)[:,None],default_fraction,allocations / emp_sum[:,None])
+#rounded half away from zero, as round does
+allocation_emp = allocations_fractions * emps['PE'][:,None]
+magnitude = numpy.abs(allocation_emp)
+allocation_emp = numpy.sign(allocation_emp) * (numpy.floor(magnitude) + (magnitude - numpy.floor(magnitude) >= 0.5))
+allocation_emp[numpy.arange(zones),max_column] = 0.0
+allocated_total = numpy.zeros(zones)
+for i in range(len(allocation_columns)):
+    allocated_total += allocation_emp[:,i]
+remainder = emps['PE'] - allocated_total
+allocation_emp[numpy.arange(zones),max_column] = numpy.where(remainder > 0,remainder,0.0)
+for i in range(len(allocation_columns)):
+    emps[allocation_columns[i]] = emps[allocation_columns[i]] + allocation_emp[:,i]
 
-#write out data, with emplyment-type aggregation
+#write out data, with emplyment-type aggregation; tazs without mazs get the (default, zero) data of taz 0
+emps = dict((column,numpy.append(emps[column],0.0)) for column in emps) #the last row is the default
+taz_rows = numpy.zeros(taz_count + 1,dtype=numpy.int64) + zones
+written = (tazs >= 0) & (tazs <= taz_count)
+taz_rows[tazs[written]] = numpy.flatnonzero(written)
+taz_rows = numpy.where(taz_rows[1:] == zones,taz_rows[0],taz_rows[1:])
+table = numpy.empty((taz_count,len(taz_columns)),dtype=object)
+table[:,0] = numpy.arange(1,taz_count + 1).tolist()
+for i in range(1,len(taz_columns)):
+    table[:,i] = emps[taz_columns[i]][taz_rows].tolist()
 with open(taz_data_file,'wb') as f:
-    f.write(','.join(taz_columns) + os.linesep)
-    for taz in range(1,taz_count+1):
-        if taz in taz_data:
-            data = taz_data[taz]
-        else:
-            data = taz_data[0]
-        line = [taz]
-        for column in taz_columns:
-            if column != 'TAZ':
-                line.append(data[column])
-        f.write(','.join(map(str,line)) + os.linesep)
+    numpy.savetxt(f,table.astype(str),fmt='%s',delimiter=',',newline=os.linesep,header=','.join(taz_columns),comments='')
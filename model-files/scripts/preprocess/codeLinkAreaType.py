@@ -1,5 +1,5 @@
 """
-  Usage: python codeLinkAreaType.py base_dir
+  Usage: python codeLinkAreaType.py base_dir [buffer_shape]
 
   Calculates MAZ Area Type using buffered population & employment density measure.
   That is, for every MAZ node within 1/2 mile of the the current MAZ node,
@@ -21,6 +21,9 @@
 
      base_dir argument: the directory in which the model runs
 
+     buffer_shape argument (optional): circle (the default), to sum the MAZs within 1/2 mile, or square, to sum
+       the MAZs within the 1 mile square centered on the MAZ (as this script originally did)
+
      base_dir\hwy\mtc_final_network_with_tolls_nodes.csv: the network nodes
 
      base_dir\hwy\mtc_final_network_with_tolls_links.csv: the network links
@@ -30,95 +33,195 @@
   Output:
      base_dir\hwy\link_area_type.csv: mapping of link to area type.  Columns are A, B, Area Type
 
+     base_dir\hwy\link_area_type.csv.npz: the state of the run (the MAZ buffer neighbours, the MAZ measures
+       and buffered sums, and the nearest MAZ of each link node), for the next run
+
+  If the state of the previous run is there, and the network files, the MAZs and the buffer shape are the same,
+  only the MAZs whose measures (POP, emp_total or ACRES) have changed are processed: the buffered sums of the
+  MAZs with any of them in their buffer are updated, and then the area types of those MAZs and of the links
+  nearest to any MAZ whose area type changed.  The results are the same as those of a full run, which is
+  done otherwise.
+
 """
 
 
 import datetime, math, os, csv, sys
-import pandas
-import rtree
+import numpy, pandas
+import scipy.sparse, scipy.spatial
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','common'))
+import file_cache
+import zone_data
+
+# the lower popemp_density bound of area types 4 (suburban) to 0 (regional core)
+AREA_TYPE_BOUNDS = [6, 30, 55, 100, 300]
+# the maz measures that are buffered
+MEASURES         = ['POP', 'emp_total', 'ACRES']
+LINK_TYPES       = ["TANA","USE","TAZ","EXT"]
+STATE_VERSION    = 1
+
+def bufferMatrix(maz_tree, buff_dist, buff_shape):
+  """
+  Returns the sparse (maz x maz) matrix with a 1 at [i,j] for each maz j within the buffer of maz i (including i itself),
+  from the KD-tree of the maz coordinates.  The buffer is a circle of radius buff_dist, or, if buff_shape is 'square', the
+  square of half-width buff_dist that the rtree bounding box query measured.
+  """
+  (x, y) = (maz_tree.data[:,0], maz_tree.data[:,1])
+  count  = len(x)
+  if buff_shape == 'square':
+    # candidates by (slightly widened) chebyshev distance, then exactly the rtree box test, which is not quite symmetric
+    pairs = maz_tree.query_pairs(buff_dist * (1 + 1e-9), p=numpy.inf, output_type='ndarray')
+    (i, j) = (pairs[:,0], pairs[:,1])
+    in_i  = (x[j] >= x[i] - buff_dist) & (x[j] <= x[i] + buff_dist) & (y[j] >= y[i] - buff_dist) & (y[j] <= y[i] + buff_dist)
+    in_j  = (x[i] >= x[j] - buff_dist) & (x[i] <= x[j] + buff_dist) & (y[i] >= y[j] - buff_dist) & (y[i] <= y[j] + buff_dist)
+    rows  = numpy.concatenate((numpy.arange(count), i[in_i], j[in_j]))
+    cols  = numpy.concatenate((numpy.arange(count), j[in_i], i[in_j]))
+  else:
+    pairs = maz_tree.query_pairs(buff_dist, output_type='ndarray')
+    rows  = numpy.concatenate((numpy.arange(count), pairs[:,0], pairs[:,1]))
+    cols  = numpy.concatenate((numpy.arange(count), pairs[:,1], pairs[:,0]))
+  return scipy.sparse.csr_matrix((numpy.ones(len(rows)), (rows, cols)), shape=(count, count))
+
+def popempDensity(totals):
+  """
+  Returns the popemp_density of each row of buffered measure totals (in the order of MEASURES); 0 if there are no acres.
+  """
+  has_acres   = totals[:,2] > 0
+  popemp_den  = numpy.zeros(len(totals))
+  popemp_den[has_acres] = (1.0 * totals[has_acres,0] + 2.5 * totals[has_acres,1]) / totals[has_acres,2]
+  return popemp_den
+
+def areaTypes(popemp_density):
+  """
+  Returns the area types of the popemp_density array (see above); undefined densities are regional core.
+  """
+  return len(AREA_TYPE_BOUNDS) - numpy.searchsorted(AREA_TYPE_BOUNDS, popemp_density, side='right')
+
+def linkNodes(maz_tree, node_df, link_df):
+  """
+  Finds the nearest maz of the A and B nodes of the links (rows) of link_df with a CNTYPE in LINK_TYPES; the nearest
+  mazs of all of those (unique) nodes are found in one KD-tree query.  Returns (coded_links, a_index, b_index, nearest),
+  where coded_links are the rows of those links, a_index and b_index are the indices of their A and B nodes, and
+  nearest is the (maz_tree) index of the nearest maz of each node.
+  """
+  coded_links = numpy.flatnonzero(link_df['CNTYPE'].isin(LINK_TYPES).values)
+  (a, b)      = (link_df['A'].values[coded_links], link_df['B'].values[coded_links])
+  link_nodes  = numpy.unique(numpy.concatenate((a, b)))
+  node_xy     = node_df.set_index('N').reindex(link_nodes)
+  nearest     = maz_tree.query(numpy.column_stack((node_xy['X'].values, node_xy['Y'].values)))[1]
+  return (coded_links, numpy.searchsorted(link_nodes, a), numpy.searchsorted(link_nodes, b), nearest)
+
+def readState(state_file, key):
+  """
+  Returns the state (a dict of arrays) saved in state_file by the previous run if it was saved with key, and otherwise None.
+  """
+  if not os.path.exists(state_file):
+    return None
+  try:
+    with numpy.load(state_file) as data:
+      state = dict((name, data[name]) for name in data.files)
+  except (IOError, OSError, ValueError):
+    return None
+  return state if state['key'].tolist() == key else None
+
+def writeState(state_file, state):
+  """
+  Saves the state (a dict of arrays) of this run to state_file.
+  """
+  try:
+    numpy.savez(state_file, **state)
+  except (IOError, OSError):
+    print 'could not write area type state ' + state_file
 
 if __name__ == '__main__':
   base_dir        = sys.argv[1]
+  BUFF_SHAPE      = sys.argv[2] if len(sys.argv) > 2 else 'circle'
   MAZ_DATA_FILE   = os.path.join(base_dir,'landuse','maz_data.csv')
   NODE_CSV_FILE   = os.path.join(base_dir,'hwy',    'mtc_final_network_with_tolls_nodes.csv')
   LINK_CSV_FILE   = os.path.join(base_dir,'hwy',    'mtc_final_network_with_tolls_links.csv')
   AREA_TYPE_FILE  = os.path.join(base_dir,'hwy',    'link_area_type.csv')
+  STATE_FILE      = AREA_TYPE_FILE + '.npz'
   BUFF_DIST       = 5280 * 0.5
 
+  if BUFF_SHAPE not in ['circle','square']:
+    print __doc__
+    sys.exit(2)
+
   print "%s Reading MAZ data" % datetime.datetime.now().strftime("%c")
-  maz_df = pandas.DataFrame.from_csv(MAZ_DATA_FILE)
-  maz_df.reset_index(inplace=True)
-
-  print "%s Reading nodes" % datetime.datetime.now().strftime("%c")
-  node_df = pandas.read_table(NODE_CSV_FILE, sep=',', names=['N','X','Y'])
-
-  # join to maz_df for maz_df coords
-  maz_df = pandas.merge(left=maz_df, right=node_df, how='left',
-                         left_on='MAZ_ORIGINAL', right_on='N')
-  maz_spatial_index = rtree.index.Index()
-  for index, row in maz_df.iterrows():
-    maz_spatial_index.insert( int(row['MAZ']), (row['X'], row['Y'], row['X'], row['Y']) )
-
-  print "%s Calculate buffered MAZ measures" % datetime.datetime.now().strftime("%c")
-  # Note: pandas.DataFrame.apply is too slow here, go back to dictionary form
-  maz_df.set_index('MAZ', inplace=True)
-  maz_dict      = maz_df.to_dict()
-  popemp_den    = {}
-  for maz in maz_dict['X'].keys():
-    total_pop   = 0
-    total_emp   = 0
-    total_acres = 0
-    for near_maz in maz_spatial_index.intersection((maz_dict['X'][maz]-BUFF_DIST, 
-                                                    maz_dict['Y'][maz]-BUFF_DIST,
-                                                    maz_dict['X'][maz]+BUFF_DIST, 
-                                                    maz_dict['Y'][maz]+BUFF_DIST)):
-      total_pop   += maz_dict['POP'][near_maz] 
-      total_emp   += maz_dict['emp_total'][near_maz] 
-      total_acres += maz_dict['ACRES'][near_maz]
-    if total_acres>0:
-      popemp_den[maz] = (1.0 * total_pop + 2.5 * total_emp) / total_acres
-    else:
-      popemp_den[maz] = 0
-  maz_dict['popemp_density'] = popemp_den
-  maz_df = pandas.DataFrame.from_dict(maz_dict)
-
-  maz_df.loc[:,                           'area_type'] = 0 # regional core
-  maz_df.loc[maz_df.popemp_density < 300, 'area_type'] = 1 # CBD
-  maz_df.loc[maz_df.popemp_density < 100, 'area_type'] = 2 # urban business
-  maz_df.loc[maz_df.popemp_density <  55, 'area_type'] = 3 # urban
-  maz_df.loc[maz_df.popemp_density <  30, 'area_type'] = 4 # suburban
-  maz_df.loc[maz_df.popemp_density <   6, 'area_type'] = 5 # rural
-  maz_df.loc[:,                           'area_type'] = maz_df.area_type.astype(int)
-  # refresh
-  maz_dict = maz_df.to_dict()
+  maz_df = zone_data.read_frame(MAZ_DATA_FILE, ['MAZ','MAZ_ORIGINAL'] + MEASURES, upcast=True)
+  measures = numpy.column_stack([maz_df[measure].values.astype(float) for measure in MEASURES])
+
+  # the previous run's state holds for the same network, buffer and mazs
+  key   = [str(STATE_VERSION), BUFF_SHAPE, repr(BUFF_DIST),
+           file_cache.hash_file(NODE_CSV_FILE), file_cache.hash_file(LINK_CSV_FILE)]
+  state = readState(STATE_FILE, key)
+  if (state is not None) and not numpy.array_equal(state['maz_nodes'], maz_df['MAZ_ORIGINAL'].values):
+    state = None
+
+  if state is None:
+    print "%s Reading nodes" % datetime.datetime.now().strftime("%c")
+    node_df = pandas.read_table(NODE_CSV_FILE, sep=',', names=['N','X','Y'])
+
+    # join to maz_df for maz_df coords
+    maz_df = pandas.merge(left=maz_df, right=node_df, how='left',
+                           left_on='MAZ_ORIGINAL', right_on='N')
+    maz_tree = scipy.spatial.cKDTree(numpy.column_stack((maz_df['X'].values, maz_df['Y'].values)))
+
+    print "%s Calculate buffered MAZ measures (%s buffer)" % (datetime.datetime.now().strftime("%c"), BUFF_SHAPE)
+    buffer_matrix = bufferMatrix(maz_tree, BUFF_DIST, BUFF_SHAPE)
+    totals        = buffer_matrix.dot(measures)
+    maz_area_type = areaTypes(popempDensity(totals))
+
+    print "%s Find nearest MAZ for each link, take min area type of A or B node" % datetime.datetime.now().strftime("%c")
+    link_df = pandas.read_table(LINK_CSV_FILE, sep=',', names=['A','B','CNTYPE'])
+    (coded_links, a_index, b_index, nearest) = linkNodes(maz_tree, node_df, link_df)
+    link_area_type = numpy.zeros(len(link_df), dtype=int) - 1
+    link_area_type[coded_links] = numpy.minimum(maz_area_type[nearest[a_index]], maz_area_type[nearest[b_index]])
+
+    state = {'key'          : numpy.array(key),
+             'maz_nodes'    : maz_df['MAZ_ORIGINAL'].values,
+             'buffer_indptr': buffer_matrix.indptr,
+             'buffer_indices': buffer_matrix.indices,
+             'link_a'       : link_df['A'].values,
+             'link_b'       : link_df['B'].values,
+             'coded_links'  : coded_links,
+             'a_index'      : a_index,
+             'b_index'      : b_index,
+             'nearest'      : nearest}
+    write_links = True
+  else:
+    buffer_matrix = scipy.sparse.csr_matrix((numpy.ones(len(state['buffer_indices'])), state['buffer_indices'], state['buffer_indptr']),
+                                            shape=(len(maz_df), len(maz_df)))
+    changed  = (measures != state['measures']).any(axis=1)
+    affected = numpy.flatnonzero(buffer_matrix.dot(changed.astype(float)) > 0)
+    print "%s Update buffered MAZ measures: %d MAZs changed, %d MAZs affected" % (datetime.datetime.now().strftime("%c"),
+                                                                              changed.sum(), len(affected))
+    totals        = state['totals']
+    totals[affected] = buffer_matrix[affected].dot(measures)
+    maz_area_type = state['maz_area_type'].copy()
+    maz_area_type[affected] = areaTypes(popempDensity(totals[affected]))
+
+    # the links with an A or B node nearest to a maz whose area type changed
+    changed_type   = (maz_area_type != state['maz_area_type'])[state['nearest']]
+    touched        = changed_type[state['a_index']] | changed_type[state['b_index']]
+    print "%s Update link area types: %d MAZ area types changed, %d links affected" % (datetime.datetime.now().strftime("%c"),
+                                                                                   (maz_area_type != state['maz_area_type']).sum(), touched.sum())
+    link_area_type = state['link_area_type']
+    link_area_type[state['coded_links'][touched]] = numpy.minimum(maz_area_type[state['nearest'][state['a_index'][touched]]],
+                                                                  maz_area_type[state['nearest'][state['b_index'][touched]]])
+    write_links = touched.any() or not os.path.exists(AREA_TYPE_FILE)
+
+  maz_df['area_type'] = maz_area_type
 
   # debug
-  # maz_df.loc[:,['MAZ','popemp_density','area_type']].to_csv('maz_new.csv',index=False)
-
-  print "%s Find nearest MAZ for each link, take min area type of A or B node" % datetime.datetime.now().strftime("%c")
-
-  link_df = pandas.read_table(LINK_CSV_FILE, sep=',', names=['A','B','CNTYPE'])
-  link_df = pandas.merge(left=link_df, right=node_df, how='left', left_on='A', right_on='N')
-  link_df.rename(columns={'X':'AX', 'Y':'AY'}, inplace=True)
-  link_df = pandas.merge(left=link_df, right=node_df, how='left', left_on='B', right_on='N')
-  link_df.rename(columns={'X':'BX', 'Y':'BY'}, inplace=True)
-  link_df.drop(['N_x','N_y'], axis=1, inplace=True)  
-
-  # Note: pandas.DataFrame.apply is too slow here, go back to dictionary form
-  link_dict = link_df.to_dict(orient='list')  # preserve index ordering
-  area_type = []
-  for link_idx in range(len(link_dict['AX'])):
-    if link_dict['CNTYPE'][link_idx] in ["TANA","USE","TAZ","EXT"]:
-      aMaz = list(maz_spatial_index.nearest((link_dict['AX'][link_idx], link_dict['AY'][link_idx], 
-                                             link_dict['AX'][link_idx], link_dict['AY'][link_idx]), 1))[0]
-      bMaz = list(maz_spatial_index.nearest((link_dict['BX'][link_idx], link_dict['BY'][link_idx], 
-                                             link_dict['BX'][link_idx], link_dict['BY'][link_idx]), 1))[0]
-      area_type.append( min( maz_dict['area_type'][aMaz], maz_dict['area_type'][bMaz] ) )
-    else:
-      area_type.append(-1)
-
-  link_dict['AREATYPE'] = area_type
-  link_df = pandas.DataFrame.from_dict(link_dict)
-
-  print "%s Write link area type CSV file" % datetime.datetime.now().strftime("%c")
-  link_df.loc[:,['A','B','AREATYPE']].to_csv(AREA_TYPE_FILE, index=False)
+  # maz_df.loc[:,['MAZ','area_type']].to_csv('maz_new.csv',index=False)
+
+  if write_links:
+    print "%s Write link area type CSV file" % datetime.datetime.now().strftime("%c")
+    link_df = pandas.DataFrame({'A':state['link_a'], 'B':state['link_b'], 'AREATYPE':link_area_type})
+    link_df.loc[:,['A','B','AREATYPE']].to_csv(AREA_TYPE_FILE, index=False)
+  else:
+    print "%s Link area types are unchanged" % datetime.datetime.now().strftime("%c")
+
+  state.update({'measures':measures, 'totals':totals, 'maz_area_type':maz_area_type, 'link_area_type':link_area_type})
+  writeState(STATE_FILE, state)
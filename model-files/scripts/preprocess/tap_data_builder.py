@@ -28,7 +28,10 @@
 """
 
 import os,sys
-import pandas
+import numpy, pandas
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','common'))
+import zone_sequence
 
 if __name__ == '__main__':
     base_dir                = sys.argv[1]
@@ -36,46 +39,38 @@ if __name__ == '__main__':
     infile                  = os.path.join(base_dir,'hwy',      'tap_to_taz_for_parking.txt')
     outfile                 = os.path.join(base_dir,'hwy',      'tap_data.csv')
 
-    sequence_mapping        = pandas.DataFrame.from_csv(zone_seq_mapping_file)
-    sequence_mapping.reset_index(inplace=True)
+    zone_seq                = zone_sequence.ZoneSequence.read(zone_seq_mapping_file)
 
     tap_data                = pandas.read_table(infile, names=['TAP_original','TAZ_original','TAZ2','SP_DISTANCE','FEET'],
                                                 delimiter=',')
-    tap_data_grouped        = tap_data.groupby('TAP_original')
-
-    tap_data_out_init       = False
-    tap_data_out            = None
-    taps                    = sequence_mapping[sequence_mapping.TAPSEQ > 0]
-    for ind,row in taps.iterrows():
-        try:
-            sorted_group = tap_data_grouped.get_group(row['N']).sort(['FEET','TAZ_original'])
-            if tap_data_out_init:
-                tap_data_out = tap_data_out.append(sorted_group.head(1))
-            else:
-                tap_data_out = sorted_group.head(1)
-                tap_data_out_init = True
-
-        except KeyError:
-            print 'tap %8d not captured in tap->taz (for parking) script' % row['N']
-            # use the last one -- does this make sense?
-            use_this = tap_data_out.tail(1).copy()
-            use_this.loc[:,'TAP_original'] = row['N']
-            tap_data_out = tap_data_out.append(use_this)
-
-    tap_data_out.reset_index(inplace=True)
-
-    # join to get the real TAZ
-    tap_data_out = pandas.merge(left=sequence_mapping[['N','TAZSEQ']], right=tap_data_out, how='right',
-                                left_on='N', right_on='TAZ_original')    # rename sequence column
-    tap_data_out.rename(columns={'TAZSEQ':'TAZ', 'N':'dropN1'}, inplace=True)
-
-    # join to get the real TAP
-    tap_data_out = pandas.merge(left=sequence_mapping[['N','TAPSEQ']], right=tap_data_out, how='right',
-                                left_on='N', right_on='TAP_original')
-    tap_data_out.rename(columns={'TAPSEQ':'TAP', 'N':'dropN2'}, inplace=True)
-
-    # drop others
-    tap_data_out.drop(['index','FEET','SP_DISTANCE','TAZ_original','TAZ2','dropN1','dropN2'], axis=1, inplace=True)
+
+    # the closest taz of each tap: the first of its rows ordered by FEET, then TAZ_original (ties in file order)
+    tap_data                = tap_data.iloc[numpy.lexsort((tap_data['TAZ_original'].values, tap_data['FEET'].values,
+                                                           tap_data['TAP_original'].values))]
+    closest                 = tap_data.drop_duplicates('TAP_original')
+
+    taps                    = zone_seq.nodes('TAP')
+    position                = numpy.minimum(numpy.searchsorted(closest['TAP_original'].values, taps), len(closest) - 1)
+    found                   = closest['TAP_original'].values[position] == taps
+    for tap in taps[~found].tolist():
+        print 'tap %8d not captured in tap->taz (for parking) script' % tap
+    # use the last one -- does this make sense?
+    use_this                = numpy.maximum.accumulate(numpy.where(found, numpy.arange(len(taps)), -1))
+    if (use_this < 0).any():
+        print 'no tap captured in tap->taz (for parking) script before tap %d' % taps[use_this < 0][0]
+        sys.exit(2)
+
+    tap_data_out            = pandas.DataFrame({'TAP_original':taps,
+                                                'TAZ_original':closest['TAZ_original'].values[position[use_this]]})
+
+    # look up the real TAZ and TAP (the taps are those of the sequence, so always found)
+    tazs                    = zone_seq.to_seq(tap_data_out['TAZ_original'].values, 'TAZ')
+    # tazs missing from the sequence (looked up as 0) are left empty, as the old join with the mapping left them
+    unmapped                = tazs == 0
+    for taz in numpy.unique(tap_data_out['TAZ_original'].values[unmapped]).tolist():
+        print 'taz %8d (closest to a tap) not in the zone sequence; left empty' % taz
+    tap_data_out['TAZ'] = numpy.where(unmapped, numpy.nan, tazs) if unmapped.any() else tazs
+    tap_data_out['TAP'] = zone_seq.to_seq(tap_data_out['TAP_original'].values, 'TAP')
 
     # are these really useful??
     tap_data_out['lotid']       = tap_data_out['TAP']
@@ -26,53 +26,106 @@
             basically a list of mazs and corresponding tazs built from maz_data.csv
         base_dir\CTRAMP\model\SoaTazDistAlternatives.csv - taz alternatives; basically a list of tazs
         base_dir\CTRAMP\model\ParkLocationSampleAlts.csv - park location sample alts; basically a list of mazs
-        
+
+    The taz and maz data files are only rewritten if their sequential numbers (or the row order) change,
+    which is generally only the first time this is run in a model run directory.  The alternatives files
+    are all written from the same sorted maz list, at the same time.
+
     crf 11/2013
 
 """
-import collections, sys, os
-import pandas
+import collections, multiprocessing.pool, sys, os
+import numpy, pandas
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','common'))
+import zone_data
+import zone_sequence
 
-def map_data(filename, sequence_mapping, mapping_dict):
-    """ This function opens the given file joins it with the given sequence_mapping DataFrame
-    according to mapping_dict.  
+def map_data(filename, zone_seq, mapping_dict, columns=[]):
+    """ This function opens the given file and adds the sequential zone numbers from the given
+    zone_seq (a zone_sequence.ZoneSequence) according to mapping_dict.  Only the node columns (and
+    any existing sequence columns) are read at first, through the zone data cache; the whole file is
+    only read and rewritten if the sequence numbers, the row order or the column order would change.
 
     Arguments:
     `filename` is the file
     `mapping_dict` defines the column assignment, mapping the new column name to a dictionary with two
-                   items: 'seqcol' should map to column name in `sequence_mapping`, and 'N_col' should
-                   map to the column that joins with `N` in sequence_mapping.
+                   items: 'seqcol' should map to the sequence column (TAZSEQ, MAZSEQ, TAPSEQ or EXTSEQ),
+                   and 'N_col' should map to the column holding the network node numbers.
+    `columns` lists any other columns to return
     
     e.g. mapping_dict = {'TAZ':{'seqcol' :'TAZSEQ',
                                 'N_col'  :'TAZ_ORIGINAL'}}
 
-    Returns the resulting DataFrame (after writing it out again)
+    Returns the sequence, node and requested columns of the resulting table, in its row order
     """
-    dframe                = pandas.DataFrame.from_csv(filename)
-    dframe.reset_index(inplace=True)
+    header                = list(pandas.read_csv(filename, nrows=0).columns.values)
+    new_header            = list(header)
+    needed                = list(columns)
+    for mapkey, mapdef in mapping_dict.iteritems():
+        # each sequence column replaces any existing one, as the first column
+        if mapkey in new_header: new_header.remove(mapkey)
+        new_header.insert(0, mapkey)
+        needed.extend([mapkey, mapdef['N_col']])
+    dframe                = zone_data.read_frame(filename, [col for col in header if col in needed], upcast=True)
 
+    # order by node (stable) for each mapping in turn, as the old join with the (node ordered) sequence mapping did
+    order                 = numpy.arange(dframe.shape[0])
     for mapkey, mapdef in mapping_dict.iteritems():
-        # delete mapkey if it's already there
-        if mapkey in list(dframe.columns.values): dframe.drop(mapkey, axis=1, inplace=True)
+        order = order[numpy.argsort(dframe[mapdef['N_col']].values[order], kind='mergesort')]
+    dframe                = dframe.iloc[order].reset_index(drop=True)
 
-        # join with sequence mapping (e.g. join N,TAZSEQ on TAZ_ORIGINAL)
-        dframe = pandas.merge(left=sequence_mapping[['N',mapdef['seqcol']]], right=dframe, how='right', 
-                              left_on='N', right_on=mapdef['N_col'])
+    changed               = (new_header != header) or (order != numpy.arange(len(order))).any()
+    for mapkey, mapdef in mapping_dict.iteritems():
+        # look up the sequence numbers (e.g. TAZSEQ of TAZ_ORIGINAL)
+        seqs = zone_seq.to_seq(dframe[mapdef['N_col']].values, mapdef['seqcol'][:-3])
+        # nodes missing from the sequence (looked up as 0) are left null, as the old join with the mapping left them
+        unmapped = seqs == 0
+        if unmapped.any():
+            print "%s: %d %s values are not in the zone sequence (left empty), e.g. %s %d" % (filename, unmapped.sum(),
+                  mapdef['N_col'], mapdef['N_col'], dframe[mapdef['N_col']].values[unmapped][0])
+            seqs = numpy.where(unmapped, numpy.nan, seqs)
+        if mapkey in dframe.columns.values:
+            old_seqs = dframe[mapkey].values
+            changed = changed or not ((old_seqs == seqs) | (pandas.isnull(old_seqs) & pandas.isnull(seqs))).all()
+        else:
+            changed = True
+        dframe[mapkey] = seqs
 
-        # drop N - it's redundant
-        dframe.drop('N', axis=1, inplace=True)
-        # rename sequence column
-        dframe.rename(columns={mapdef['seqcol']:mapkey}, inplace=True)
+    if changed:
+        full_dframe = pandas.DataFrame.from_csv(filename)
+        full_dframe.reset_index(inplace=True)
+        full_dframe.drop([mapkey for mapkey in mapping_dict if mapkey in header], axis=1, inplace=True)
+        full_dframe = full_dframe.iloc[order].reset_index(drop=True)
+        for mapkey in mapping_dict:
+            full_dframe.insert(0, mapkey, dframe[mapkey].values)
 
-    # write it
-    dframe.to_csv(filename, index=False, float_format="%.9f")
-    print "Wrote %s" % filename
-    return dframe
+        # write it
+        full_dframe.to_csv(filename, index=False, float_format="%.9f")
+        print "Wrote %s" % filename
+    else:
+        print "%s is unchanged" % filename
+    return dframe[[col for col in new_header if col in dframe.columns.values]]
 
-if __name__ == '__main__':
-    ### shhhh
-    pandas.options.mode.chained_assignment = None  # default='warn'
+def format_column(values):
+    """ Returns the values of the given array as strings, as pandas writes them (nulls as empty strings).
+    """
+    strings = values.astype(str)
+    if values.dtype.kind not in 'iub':
+        strings[pandas.isnull(values)] = ''
+    return strings
+
+def write_csv(task):
+    """ Writes a csv file; task is (filename, column names, column arrays). Returns the filename.
+    """
+    (filename, names, columns) = task
+    strings = [format_column(column) for column in columns]
+    with open(filename, 'w') as f:
+        f.write(','.join(names) + '\n')
+        f.writelines(','.join(row) + '\n' for row in zip(*strings))
+    return filename
 
+if __name__ == '__main__':
     base_dir                = sys.argv[1]
     zone_seq_mapping_file   = os.path.join(base_dir,'hwy',      'mtc_final_network_zone_seq.csv')
     taz_data_file           = os.path.join(base_dir,'landuse',  'taz_data.csv') # TAZ,TAZ_ORIGINAL,AVGTTS,DIST,PCTDETOUR,TERMINALTIME
@@ -87,46 +140,30 @@ if __name__ == '__main__':
     soa_dist_alts_file      = os.path.join(model_files_dir,'SoaTazDistAlternatives.csv')  # a,dest (a,taz)
     parking_soa_alts_file   = os.path.join(model_files_dir,'ParkLocationSampleAlts.csv')  # a,mgra
     
-    sequence_mapping        = pandas.DataFrame.from_csv(zone_seq_mapping_file)
-    sequence_mapping.reset_index(inplace=True)
+    zone_seq                = zone_sequence.ZoneSequence.read(zone_seq_mapping_file)
     
     ######### map TAZ_ORIGINAL to the actual TAZ
-    taz_data = map_data(taz_data_file, sequence_mapping, {'TAZ':{'seqcol':'TAZSEQ','N_col':'TAZ_ORIGINAL'}})
+    taz_data = map_data(taz_data_file, zone_seq, {'TAZ':{'seqcol':'TAZSEQ','N_col':'TAZ_ORIGINAL'}})
     
     ######### map TAZ_ORIGINAL to the actual TAZ and MAZ_ORIGINAL to MAZ
     mapping_dict = collections.OrderedDict()
     mapping_dict['TAZ'] = {'seqcol':'TAZSEQ','N_col':'TAZ_ORIGINAL'}
     mapping_dict['MAZ'] = {'seqcol':'MAZSEQ','N_col':'MAZ_ORIGINAL'}
-    maz_data = map_data(maz_data_file, sequence_mapping,mapping_dict)
-    
-    ######### parkarea ?
-    parkarea = maz_data[['MAZ','parkarea']]
-    parkarea.sort(['MAZ'], inplace=True)
-    parkarea.reset_index(drop=True, inplace=True)
-    parkarea.loc[:,'a'] = range(1, parkarea.shape[0] + 1) # isn't this pointless?  MAZ is a consecutive sequence already
-    parkarea.rename(columns={'MAZ':'mgra'}, inplace=True)
-    parkarea = parkarea[['a','mgra','parkarea']]
-    parkarea.to_csv(park_location_alts_file, index=False)
-    print "Wrote %s" % park_location_alts_file
-
-    ######### dc alternatives ?
-    dcalts = maz_data[['MAZ','TAZ']]
-    dcalts.sort(['MAZ','TAZ'], inplace=True)
-    dcalts.reset_index(drop=True, inplace=True)
-    dcalts.loc[:,'a'] = range(1, dcalts.shape[0] + 1) # isn't this pointless?  MAZ is a consecutive sequence already
-    dcalts.rename(columns={'MAZ':'mgra', 'TAZ':'dest'}, inplace=True)
-    dcalts = dcalts[['a','mgra','dest']]
-    dcalts.to_csv(dc_alts_file, index=False)
-    print "Wrote %s" % dc_alts_file
+    maz_data = map_data(maz_data_file, zone_seq, mapping_dict, ['parkarea'])
     
-    ######### these seem truly pointless
-    dcalts.drop('dest', axis=1, inplace=True)
-    dcalts.to_csv(parking_soa_alts_file, index=False)
-    print "Wrote %s" % parking_soa_alts_file
-
-    soa_dist_alts = taz_data[['TAZ']]
-    soa_dist_alts.loc[:,'a'] = range(1, soa_dist_alts.shape[0] + 1) # ???
-    soa_dist_alts.rename(columns={'TAZ':'dest'}, inplace=True)
-    soa_dist_alts = soa_dist_alts[['a','dest']]
-    soa_dist_alts.to_csv(soa_dist_alts_file, index=False)
-    print "Wrote %s" % soa_dist_alts_file
+    ######### the alternatives, from the mazs in MAZ (then TAZ) order
+    maz_order = numpy.lexsort((maz_data['TAZ'].values, maz_data['MAZ'].values))
+    mgra      = maz_data['MAZ'].values[maz_order]
+    maz_alts  = numpy.arange(1, len(maz_order) + 1) # isn't this pointless?  MAZ is a consecutive sequence already
+    taz_alts  = numpy.arange(1, taz_data.shape[0] + 1) # ???
+    tasks     = [(park_location_alts_file, ['a','mgra','parkarea'], [maz_alts, mgra, maz_data['parkarea'].values[maz_order]]),
+                 (dc_alts_file,            ['a','mgra','dest'],     [maz_alts, mgra, maz_data['TAZ'].values[maz_order]]),
+                 (parking_soa_alts_file,   ['a','mgra'],            [maz_alts, mgra]), # these seem truly pointless
+                 (soa_dist_alts_file,      ['a','dest'],            [taz_alts, taz_data['TAZ'].values])]
+
+    # the files are small, so they are written by threads
+    pool = multiprocessing.pool.ThreadPool(len(tasks))
+    for filename in pool.map(write_csv, tasks):
+        print "Wrote %s" % filename
+    pool.close()
+    pool.join()
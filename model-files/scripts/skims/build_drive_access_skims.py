@@ -15,7 +15,41 @@
     shortest path from TAZ->TAZ->MAZ->TAP. The first link is given by the highway skim (1), the 
     second value (zero-cost) is provided by the MAZ-TAZ corresponence (2). The third link is 
     privided by the MAZ->TAP walk access skim.
-    
+
+    The search is done with arrays: each period's TAZ->TAZ skim is loaded into a dense cost matrix,
+    the columns for each mode's TAPs (via their closest TAZ) are gathered, the TAP walk times are
+    added, and a row-wise minimum picks the best TAP for every TAZ.
+
+    The time periods are independent, so (after the shared lookups are built once) they are built
+    concurrently in a pool of worker processes. The number of workers is set by DRIVE_ACCESS_WORKERS
+    in driveAccessParam.block (0, the default, uses one per processor; 1 runs the periods serially).
+    Results are written by period, mode, and TAZ, so the output does not depend on the worker count.
+
+    By default only the lowest cost TAP is kept for each period, mode, and TAZ. Setting DRIVE_ACCESS_TAPS
+    (in driveAccessParam.block) to K > 1 keeps the K lowest cost TAPs instead, and adds a column:
+
+        RANK - The rank (1 = lowest cost) of the TAP for the FTAZ, MODE, and PERIOD
+
+    The search can be pruned to TAPs whose closest TAZ is within a drive time (DRIVE_ACCESS_MAX_TIME) or
+    generalized drive cost (DRIVE_ACCESS_MAX_COST) of the origin TAZ, taken from the TAZ->TAZ skim. A TAP's
+    total cost is never less than the drive time/cost to its TAZ, so any TAZ whose best TAP(s) fall within
+    the bound is exact; TAZs where the bound is binding are searched again exhaustively, so the results are
+    the same as without pruning. The number of pruned candidates is reported by period and mode.
+
+    With DRIVE_ACCESS_INCREMENTAL = 1, a manifest (skims\drive_maz_taz_tap_manifest.pkl) holding the input
+    file hashes, the shared lookups, and the results by period and mode is written next to the output. On
+    the next run, the lookups are only rebuilt if one of their inputs changed, and a period/mode is only
+    rebuilt if its skim, its candidate TAPs (e.g. a headway change in that period), the cost parameters, or
+    the zone numbering changed; a period with nothing to rebuild does not read its skim at all.
+
+    With DRIVE_ACCESS_EGRESS = 1, the TAP->TAZ (drive egress) direction is built in the same pass, from the same
+    skim read: the TAP TAZ->TAZ part of the skim is put into a second array (about doubling the skim arrays held
+    by each period's worker), which is searched through its transpose, so the same search finds the best TAP
+    for each destination TAZ. The egress skim is written to
+    skims\drive_maz_taz_tap_egress.csv, with the same columns as the access skim; there FTAZ is the TAZ being
+    driven to, DTIME/DDIST/DTOLL are for the drive from the TAP's TAZ (TTAZ) to FTAZ, and WDIST is the walk
+    distance between the TAP and its MAZ (TMAZ).
+
     The output of this script is a csv file with the following columns:
     
         FTAZ,MODE,PERIOD,TTAP,TMAZ,TTAZ,DTIME,DDIST,DTOLL,WDIST
@@ -36,13 +70,19 @@
 
 """
 
-import os,sys,re
+import os,sys
+import cPickle,hashlib,multiprocessing
 import time as pytime
+import numpy, pandas
 
-base_dir = sys.argv[1]
-block_dir = sys.argv[2]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','common'))
+import file_cache
+import transit_line_file
+import zone_data
+import zone_sequence
 
 PERIOD_TOKEN = '@PERIOD@'
+periods = ['EA','AM','MD','PM','EV']
 id_mode_map = {1:'LOCAL_BUS',
                2:'EXPRESS_BUS',
                #3:'FERRY_SERVICE',
@@ -50,241 +90,511 @@ id_mode_map = {1:'LOCAL_BUS',
                4:'LIGHT_RAIL',
                5:'HEAVY_RAIL',
                6:'COMMUTER_RAIL'}
-#input files
-#skim_taz_to_node_file = os.path.join(base_dir,r'hwy\avgload' + PERIOD_TOKEN + '_taz_to_node.txt')
-#taz_to_tazn_mapping_file = os.path.join(base_dir,r'hwy\node_maz_taz_data.csv')
-#maz_to_taz_mapping_file = os.path.join(base_dir,r'hwy\node_maz_taz_lookup.csv')
-maz_to_taz_mapping_file = os.path.join(base_dir,r'landuse\maz_data.csv')
-hwy_parameter_block_file = os.path.join(block_dir,r'hwyParam.block')
-ped_maz_tap_distance_file = os.path.join(base_dir,r'skims\ped_distance_maz_tap.txt')
-transit_line_file = os.path.join(base_dir,r'trn\transitLines.lin')
-network_tap_nodes_file = os.path.join(base_dir,r'hwy\mtc_final_network_tap_nodes.csv')
-network_tap_links_file = os.path.join(base_dir,r'hwy\mtc_final_network_tap_links.csv')
-skim_taz_taz_time_file = os.path.join(base_dir,r'skims\DA_' + PERIOD_TOKEN + '_taz_time.csv')
-drive_tansit_skim_out_file = os.path.join(base_dir,r'skims\drive_maz_taz_tap.csv')
-n_seq_file = os.path.join(base_dir,r'hwy\mtc_final_network_zone_seq.csv')
+#unique modes, in id order (used for output ordering)
+modes = []
+for mode_id in sorted(id_mode_map):
+    if not id_mode_map[mode_id] in modes:
+        modes.append(id_mode_map[mode_id])
 
+#lookups shared by the period builders; set by initWorker in each (worker) process
+shared = None
 
+def readBlockFile(block_file):
+    """ Reads a parameter block file (KEY = value ; comment) into a dict of floats, skipping comment lines.
+    """
+    block_data = {}
+    for line in open(block_file):
+        line = line.split(';')[0].strip()
+        if len(line) == 0:
+            continue
+        line = line.split('=')
+        block_data[line[0].strip()] = float(line[1].strip())
+    return block_data
 
-start_time = pytime.time()
+def resultSignature(lookups,zone_seq_hash,skim_hash,period,mode):
+    """ Returns a signature of everything the drive access result for a period and mode depends on: the period's
+    skim, the mode's candidate taps (which carry the transit line/headway, tap, and walk access inputs), the cost
+    parameters, the zone numbering, the number of taps kept, and whether egress skims are built.
+    """
+    return hashlib.md5(repr((zone_seq_hash,skim_hash,lookups['candidates'][period][mode],lookups['auto_op_cost'],
+                             lookups['vot'],lookups['taps_per_taz'],lookups['egress']))).hexdigest()
 
-periods = ['EA','AM','MD','PM','EV']
-
-print 'reading node->taz/maz/tap sequence mapping'
-seq_mapping = {}
-tazseq_mapping = {}
-mazseq_mapping = {}
-tapseq_mapping = {}
-extseq_mapping = {}
-for line in open(n_seq_file):
-    data = map(int,line.strip().split(','))
-    if data[1] > 0:
-        seq_mapping[data[0]] = data[1]
-        tazseq_mapping[data[1]] = data[0]
-    if data[2] > 0:
-        seq_mapping[data[0]] = data[2]
-        mazseq_mapping[data[2]] = data[0]
-    if data[3] > 0:
-        seq_mapping[data[0]] = data[3]
-        tapseq_mapping[data[3]] = data[0]
-    if data[4] > 0:
-        seq_mapping[data[0]] = data[4]
-        extseq_mapping[data[4]] = data[0]
-
-print 'reading maz->taz'
-#read maz->taz mapping
-mazn_tazn_mapping = {}
-#maz,taz
-header = None
-for line in open(maz_to_taz_mapping_file):
-    data = line.strip().split(',')
-    if header is None:
-        header = data
-        col_taz = header.index('TAZ_ORIGINAL')
-        col_maz = header.index('MAZ_ORIGINAL')
-        continue
-    mazn_tazn_mapping[int(data[col_maz])] = int(data[col_taz])
-    
-#read param block
-print 'reading hwy parameter block data'
-block_data = {}
-for line in open(hwy_parameter_block_file):
-    line = line.strip()
-    if len(line) == 0:
-        continue
-    line = line.split('=')
-    key = line[0].strip()
-    value = float(line[1].split(';')[0].strip())
-    block_data[key] = value
-    
-global auto_op_cost
-global vot
-global walk_rate
-auto_op_cost = block_data['AUTOOPCOST'] / 5280 #correct for feet
-vot = 0.6 / block_data['VOT'] #turn into minutes / cents
-walk_rate = 60.0 / 3.0 / 5280.0
-
-print 'reading maz->tap skims and building tap->maz/taz lookup'
-#read maz->tap walk skims
-#build tap-> (closest) (maz,taz,maz->tap walk_time)
-tapn_tazn_lookup = {}
-tapns = {}
-for line in open(ped_maz_tap_distance_file):
-    line = line.strip().split(',')
-    mazn = mazseq_mapping[int(line[0])]
-    tapn = tapseq_mapping[int(line[1])]
-    distance = float(line[4])
-    walk_time = walk_rate*distance
-    tapns[tapn] = None
-    tazn = mazn_tazn_mapping[mazn]
-    if (not tapn in tapn_tazn_lookup) or (tapn_tazn_lookup[tapn][2] > walk_time):
-        tapn_tazn_lookup[tapn] = (mazn,tazn,walk_time,distance)
-tapns = list(tapns.keys())
-tapns.sort()
-
-
-print 'reading transit lines'
-#read transit lines to pull out tod and stop information
-stops_by_tod_and_mode = {}
-for period in periods:
-    stops_by_tod_and_mode[period] = {}
-#LINE NAME="EM_HOLLIS", USERA1="Emery Go-Round", USERA2="Local bus", MODE=12, ONEWAY=T, XYSPEED=15, HEADWAY[1]=60.0, HEADWAY[2]=12.0, HEADWAY[3]=20.0, HEADWAY[4]=12.0, HEADWAY[5]=30.0, N=2565595,...
-for line in open(transit_line_file):
-    split_line = map(str.strip,re.split('[=,]',line.strip()))
-    if len(split_line) < 3:
-        continue
-    mode = split_line[split_line.index('USERA2') + 1].replace('"','').upper().replace(' ','_')
-    tod = []
-    for i in range(len(periods)):
-        tod.append(float(split_line[split_line.index('HEADWAY[' + str(i+1) + ']') + 1]) > 0.0)
-        period = periods[i]
-        if not mode in stops_by_tod_and_mode[period]:
-            stops_by_tod_and_mode[period][mode] = {}
-    stop_nodes = {}
-    for i in range(split_line.index('N') + 1,len(split_line)):
-        n = int(split_line[i])
-        if n > 0:
-            stop_nodes[n] = None
-    for i in range(len(tod)):
-        if tod[i]:
-            for n in stop_nodes:
-                stops_by_tod_and_mode[periods[i]][mode][n] = None
-
-                
-id_mode_map = {1:'LOCAL_BUS',
-               2:'EXPRESS_BUS',
-               #3:'FERRY_SERVICE',
-               3:'LIGHT_RAIL',
-               4:'LIGHT_RAIL',
-               5:'HEAVY_RAIL',
-               6:'COMMUTER_RAIL'}
-print 'building tap->mode'
-tapn_to_mode = {}
-for line in open(network_tap_nodes_file):
-    tapn,mode = map(int,line.strip().split(','))
-    tapn_to_mode[tapn] = id_mode_map[mode]
+def initWorker(lookups):
+    """ Stores the shared lookups (built once by the main process) for use by buildPeriod.
+    """
+    global shared
+    global auto_op_cost
+    global vot
+    shared = lookups
+    auto_op_cost = lookups['auto_op_cost']
+    vot = lookups['vot']
 
-    
-print 'building tod->mode->taps'
-tod_mode_tapn = {}
-for period in periods:
-    tod_mode_tapn[period] = {}
-    for mode_id in id_mode_map:
-        tod_mode_tapn[period][id_mode_map[mode_id]] = {}
-isolated_tapns = {}
-for line in open(network_tap_links_file):
-    a,b = map(int,line.strip().split(','))
-    if (a < 900000) and (a % 100000 > 90000):
-        tapn = a
-        stopn = b
-    else:
-        tapn = b
-        stopn = a
-    #stops_by_tod_and_mode[periods[i]][mode][n]
-    if not tapn in tapn_to_mode:
-        print 'tapn not found in (' + str(a) + ',' + str(b) + ')'
-        continue
-    mode = tapn_to_mode[tapn]
-    for period in periods:
-        if not tapn in tod_mode_tapn[period][mode]:
-            #check to see if tap is available in this period
-            if stopn in stops_by_tod_and_mode[periods[i]][mode]:
-                if not tapn in tapn_tazn_lookup:
-                    isolated_tapns[tapn] = None
-                else:
-                    tod_mode_tapn[period][mode][tapn] = tapn_tazn_lookup[tapn] #closest (mazn,tazn,walk_time from mazn to tapn,walk_distance from mazn to tapn)
-print 'taps with no (apparent) walk access: ' + str(isolated_tapns.keys())
-
-print 'building list of tazs with taps by tod'
-tazs_with_taps = {} #period -> tazs
-for period in periods:
-    tazs_with_taps[period] = {}
-    for mode in tod_mode_tapn[period]:
-        for tapn in tod_mode_tapn[period][mode]:
-            tazs_with_taps[period][tod_mode_tapn[period][mode][tapn][1]] = None
-
-            
 def formCost(time,dist,toll):
     return time + vot*(dist * auto_op_cost + toll)
 
+def readTazSkim(skim_file,col_tazns,egress=False):
+    """ Reads the taz->taz skim in skim_file into dense arrays. Rows are indexed by (sequential) from-taz,
+    columns by the position of the to-taz node in col_tazns; only the destination tazs in col_tazns are kept.
 
+    Returns (tazns,cost,pos,skim) where tazns is the sorted list of from-taz nodes, cost holds the generalized
+    cost (inf if the pair is missing), pos holds the row of the pair in skim (-1 if missing), and skim is the
+    raw (I,J,[something],TIMEDA,DISTDA[,BTOLLDA]) array.
 
-# tod_mode_tapn[period][mode][tapn] = (mazn,tazn,distance)
-drive_access_costs = {}
-for period in periods:
-    
+    If egress is set, (egress_tazns,egress_cost,egress_pos) are also returned for the opposite direction, built
+    from the same (parsed) skim array: they hold the pairs from the tazs in col_tazns to every taz, transposed so
+    they are indexed by (sequential) to-taz and col_tazns position just like cost/pos. They cannot be views of
+    cost/pos: those hold the pairs from every taz to the tazs in col_tazns, and the skim is directed, so the
+    egress pairs are other entries of the skim and need arrays of their own (of the same size as cost/pos).
+    """
+    #round_trip keeps the parsed floats identical to float() so results match the old line-by-line reader
+    skim = pandas.read_csv(skim_file,header=None,dtype=numpy.float64,float_precision='round_trip').values
+    ftaz = skim[:,0].astype(numpy.int32)
+    ttaz = skim[:,1].astype(numpy.int32)
+    size = max(ftaz.max(),ttaz.max()) + 1
+    col_index = numpy.zeros(size,dtype=numpy.int32) - 1
+    for col in range(len(col_tazns)):
+        col_index[shared['seq_mapping'][col_tazns[col]]] = col
+    cost,pos = skimArrays(skim,ftaz,col_index[ttaz],(size,len(col_tazns)))
+    tazns = sorted(shared['tazseq_mapping'][seq] for seq in numpy.unique(ftaz))
+    if not egress:
+        return tazns,cost,pos,skim
+    #the (col_tazns x taz) pairs, a different set of skim entries than cost/pos (see above)
+    egress_cost,egress_pos = skimArrays(skim,col_index[ftaz],ttaz,(len(col_tazns),size))
+    egress_tazns = sorted(shared['tazseq_mapping'][seq] for seq in numpy.unique(ttaz))
+    return tazns,cost,pos,skim,egress_tazns,egress_cost.T,egress_pos.T
+
+def skimArrays(skim,rows,cols,shape):
+    """ Builds the (shape) generalized cost and skim row arrays for the skim entries, placing entry i at
+    (rows[i],cols[i]); entries with a negative row or column are left out.
+    """
+    keep = numpy.nonzero((rows >= 0) & (cols >= 0))[0]
+    toll = skim[keep,5] if skim.shape[1] == 6 else 0.0
+    cost = numpy.empty(shape)
+    cost.fill(numpy.inf)
+    cost[rows[keep],cols[keep]] = formCost(skim[keep,3],skim[keep,4],toll)
+    pos = numpy.zeros(shape,dtype=numpy.int32) - 1
+    pos[rows[keep],cols[keep]] = keep
+    return cost,pos
+
+def rankTaps(taz_index,tap_index,tap_costs,k):
+    """ Orders (taz,tap,cost) entries by taz, cost, and candidate (tap) order, and keeps the first k for each taz.
+    """
+    order = numpy.lexsort((tap_index,tap_costs,taz_index))
+    (taz_index,tap_index,tap_costs) = (taz_index[order],tap_index[order],tap_costs[order])
+    rank = numpy.arange(len(taz_index)) - numpy.searchsorted(taz_index,taz_index)
+    keep = rank < k
+    return taz_index[keep],tap_index[keep],tap_costs[keep]
+
+def addTaps(best,block_tazns,rows,taz_index,tap_index,tap_costs,tapns,cols,pos,skim):
+    """ Appends the ranked (taz,tap,cost) entries, with their drive skim values, to the best tap lists.
+    """
+    skim_rows = pos[rows[taz_index],cols[tap_index]]
+    times = skim[skim_rows,3].tolist()
+    dists = skim[skim_rows,4].tolist()
+    tolls = skim[skim_rows,5].tolist() if skim.shape[1] == 6 else [0.0]*len(skim_rows)
+    tap_costs = tap_costs.tolist()
+    for i in range(len(taz_index)):
+        best[block_tazns[taz_index[i]]].append((tap_costs[i],tapns[tap_index[i]],times[i],dists[i],tolls[i]))
+
+def findBestTaps(tazns,cost,pos,skim,col_tazn_index,candidates,k=1,block_size=500):
+    """ Finds the k minimum cost taps for each taz in tazns. candidates is a list of (tapn,tazn,walk_time) for
+    the taps available to the mode/period; its order is used for ties (of equal cost taps, the first one wins).
+    The search gathers the cost columns for each tap's closest taz, adds the tap walk times, and partitions each
+    row around its k-th smallest cost, so only the (few) taps at or below that cost are ever sorted. It works
+    through block_size tazs at a time to bound memory.
+
+    Returns a dict mapping tazn to a list of up to k (cost,tapn,time,dist,toll) tuples, lowest cost first;
+    the list is empty if no tap is reachable.
+    """
+    best = {}
+    for tazn in tazns:
+        best[tazn] = []
+    if len(candidates) == 0:
+        return best
+    k = min(k,len(candidates))
+    tapns = [candidate[0] for candidate in candidates]
+    cols = numpy.array([col_tazn_index[candidate[1]] for candidate in candidates],dtype=numpy.int32)
+    walk_time = numpy.array([candidate[2] for candidate in candidates])
+    for start in range(0,len(tazns),block_size):
+        block_tazns = tazns[start:start + block_size]
+        rows = numpy.array([shared['seq_mapping'][tazn] for tazn in block_tazns],dtype=numpy.int32)
+        block_cost = cost[rows][:,cols] + walk_time
+        kth_cost = numpy.partition(block_cost,k - 1,axis=1)[:,k - 1]
+        #taps at or below the k-th cost (more than k only if there are ties)
+        (taz_index,tap_index) = numpy.nonzero((block_cost <= kth_cost[:,numpy.newaxis]) & (block_cost < numpy.inf))
+        (taz_index,tap_index,tap_costs) = rankTaps(taz_index,tap_index,block_cost[taz_index,tap_index],k)
+        addTaps(best,block_tazns,rows,taz_index,tap_index,tap_costs,tapns,cols,pos,skim)
+    return best
+
+def findBestTapsPruned(tazns,cost,pos,skim,col_tazn_index,candidates,within,bound,k=1,block_size=500):
+    """ Same as findBestTaps, but for each taz only the taps whose closest taz is within the drive time/cost
+    bound are considered. within is a (from taz x column) boolean array marking the taz pairs inside the bound.
+
+    The total cost of a tap is at least the drive time (and the drive cost) to its closest taz, so every pruned
+    tap costs more than bound. A taz whose k-th best (pruned) cost is no more than bound therefore has exactly
+    the taps the exhaustive search would find; any other taz (where the bound was binding) is searched again
+    with findBestTaps, so the result is always the same as findBestTaps.
+
+    Returns (best,pruned,exhaustive) where best is as in findBestTaps, pruned is the number of taz->tap
+    candidates skipped, and exhaustive is the number of tazs that had to be searched exhaustively.
+    """
+    best = {}
+    for tazn in tazns:
+        best[tazn] = []
+    if len(candidates) == 0:
+        return best,0,0
+    k = min(k,len(candidates))
+    tapns = [candidate[0] for candidate in candidates]
+    cols = numpy.array([col_tazn_index[candidate[1]] for candidate in candidates],dtype=numpy.int32)
+    walk_time = numpy.array([candidate[2] for candidate in candidates])
+    #taps grouped by column (stable, so candidate order is kept within a column)
+    col_taps = numpy.argsort(cols,kind='mergesort')
+    col_counts = numpy.bincount(cols,minlength=cost.shape[1])
+    col_offsets = numpy.cumsum(col_counts) - col_counts
+    pruned = 0
+    binding_tazns = []
+    for start in range(0,len(tazns),block_size):
+        block_tazns = tazns[start:start + block_size]
+        rows = numpy.array([shared['seq_mapping'][tazn] for tazn in block_tazns],dtype=numpy.int32)
+        #expand each (taz,column) pair inside the bound to the taps in that column
+        (taz_index,col_index) = numpy.nonzero(within[rows])
+        counts = col_counts[col_index]
+        taz_index = numpy.repeat(taz_index,counts)
+        first = numpy.repeat(col_offsets[col_index] - (numpy.cumsum(counts) - counts),counts)
+        tap_index = col_taps[first + numpy.arange(len(taz_index))]
+        pruned += len(rows)*len(candidates) - len(tap_index)
+        tap_costs = cost[rows[taz_index],cols[tap_index]] + walk_time[tap_index]
+        reachable = tap_costs < numpy.inf
+        (taz_index,tap_index,tap_costs) = rankTaps(taz_index[reachable],tap_index[reachable],tap_costs[reachable],k)
+        #tazs with k taps, the last (k-th) within the bound, are exact
+        found = numpy.bincount(taz_index,minlength=len(rows))
+        exact = numpy.zeros(len(rows),dtype=bool)
+        last = numpy.cumsum(found) - 1
+        exact[found == k] = tap_costs[last[found == k]] <= bound
+        keep = exact[taz_index]
+        addTaps(best,block_tazns,rows,taz_index[keep],tap_index[keep],tap_costs[keep],tapns,cols,pos,skim)
+        binding_tazns.extend(block_tazns[i] for i in numpy.nonzero(~exact)[0])
+    if len(binding_tazns) > 0:
+        best.update(findBestTaps(binding_tazns,cost,pos,skim,col_tazn_index,candidates,k,block_size))
+    return best,pruned,len(binding_tazns)
+
+def findModeTaps(label,tazns,cost,pos,skim,col_tazn_index,candidates):
+    """ Runs findBestTaps, or findBestTapsPruned if a drive time/cost bound is set, for one direction of a
+    period/mode, and reports the pruning. label identifies the period/mode/direction in the report.
+    """
+    max_time = shared['max_time']
+    max_cost = shared['max_cost']
+    if not (max_time > 0 or max_cost > 0):
+        return findBestTaps(tazns,cost,pos,skim,col_tazn_index,candidates,shared['taps_per_taz'])
+    #pairs with no skim entry have inf cost, so are never within the bound
+    within = cost < numpy.inf
+    if max_time > 0:
+        within &= skim[pos,3] <= max_time
+    if max_cost > 0:
+        within &= cost <= max_cost
+    bound = min(bound for bound in (max_time,max_cost) if bound > 0)
+    (best,pruned,exhaustive) = findBestTapsPruned(tazns,cost,pos,skim,col_tazn_index,candidates,within,bound,
+                                                  shared['taps_per_taz'])
+    print '  ' + label + ': pruned ' + str(pruned) + ' of ' + str(len(tazns)*len(candidates)) + \
+          ' taz->tap candidates, ' + str(exhaustive) + ' tazs searched exhaustively (bound binding)'
+    return best
+
+def buildPeriod(task):
+    """ Builds the drive access skim for a single period, using the shared lookups. Runs in a worker process
+    when the periods are built concurrently. task is (period,modes), the modes to build for the period.
+
+    Returns a dict mapping mode to (access,egress), the findBestTaps results for the taz->tap and (if egress
+    skims are being built, else None) the tap->taz direction.
+    """
+    (period,period_modes) = task
     print 'reading taz->taz skim for ' + period + ' and building drive access skim'
     #read the taz->taz skim
-    #skimtaz_tazn_map = skimtaz_tazn_mapping[period]
-    skimtaz_tazn_map = tazseq_mapping
-    tazn_tazn_skim = {}
-    tazns = {} #unique set of taz nodes
-    
-    for line in open(skim_taz_taz_time_file.replace(PERIOD_TOKEN,period)):
-        line = line.strip().split(',') #1,1,1,0.21,460.5  #I,J,[something],TIMEDA,DISTDA[,BTOLLDA]
-        ftazn = skimtaz_tazn_map[int(line[0])]
-        ttazn = skimtaz_tazn_map[int(line[1])]
-        if not ftazn in tazn_tazn_skim:
-            tazn_tazn_skim[ftazn] = {}
-        if ttazn in tazs_with_taps[period]:
-            time = float(line[3])
-            dist = float(line[4])
-            toll = 0.0
-            if len(line) == 6:
-                toll = float(line[5])
-            tazn_tazn_skim[ftazn][ttazn] = (formCost(time,dist,toll),time,dist,toll)
-        tazns[ftazn] = None
-    tazns = list(tazns.keys())
-    tazns.sort()
-    
+    candidates = shared['candidates'][period]
+    col_tazns = list(shared['tazs_with_taps'][period].keys())
+    col_tazn_index = dict((col_tazns[col],col) for col in range(len(col_tazns)))
+    skim_file = shared['skim_taz_taz_time_file'].replace(PERIOD_TOKEN,period)
+    if shared['egress']:
+        (tazns,cost,pos,skim,egress_tazns,egress_cost,egress_pos) = readTazSkim(skim_file,col_tazns,True)
+    else:
+        (tazns,cost,pos,skim) = readTazSkim(skim_file,col_tazns)
+
     print 'building drive access skims for period ' + period
-    drive_access_costs[period] = {}
-    for mode_id in id_mode_map:
-        mode = id_mode_map[mode_id]
-        drive_access_costs[period][mode] = {}
-        for tazn in tazns:
-            drive_access_costs[period][mode][tazn] = None
+    period_costs = {}
+    for mode in period_modes:
+        access = findModeTaps(period + ' ' + mode,tazns,cost,pos,skim,col_tazn_index,candidates[mode])
+        egress = None
+        if shared['egress']:
+            egress = findModeTaps(period + ' ' + mode + ' egress',egress_tazns,egress_cost,egress_pos,skim,
+                                  col_tazn_index,candidates[mode])
+        period_costs[mode] = (access,egress)
+    return period_costs
+
+def writeDriveSkim(out_file,drive_costs,tod_mode_tapn,seq_mapping,taps_per_taz):
+    """ Writes the drive access (or egress) results in drive_costs[period][mode][tazn] to out_file, by period,
+    mode, and taz.
+    """
+    f = open(out_file,'wb')
+    columns = ['FTAZ','MODE','PERIOD','TTAP','TMAZ','TTAZ','DTIME','DDIST','DTOLL','WDIST']
+    if taps_per_taz > 1:
+        columns.append('RANK')
+    f.write(','.join(columns) + os.linesep)
+    for period in periods:
+        for mode in modes:
+            for tazn in sorted(drive_costs[period][mode]):
+                for rank in range(len(drive_costs[period][mode][tazn])):
+                    (fcost,tapn,time,dist,toll) = drive_costs[period][mode][tazn][rank]
+                    (tmazn,ttazn,wtime,wdist) = tod_mode_tapn[period][mode][tapn]
+                    data = [seq_mapping[tazn],mode,period,seq_mapping[tapn],seq_mapping[tmazn],seq_mapping[ttazn],time,dist,toll,wdist]
+                    if taps_per_taz > 1:
+                        data.append(rank + 1)
+                    f.write(','.join(map(str,data)) + os.linesep)
+    f.close()
+
+def buildLookups(input_files):
+    """ Reads the (non-skim) inputs and builds the lookups shared by the period builders. input_files maps
+    the input names (zone_seq, maz_data, hwy_param, ped_maz_tap, transit_lines, tap_nodes, tap_links) to files.
+
+    Returns (lookups,tod_mode_tapn), where tod_mode_tapn[period][mode][tapn] = (mazn,tazn,walk_time,distance).
+    """
+    print 'reading node->taz/maz/tap sequence mapping'
+    zone_seq = zone_sequence.ZoneSequence.read(input_files['zone_seq'])
+    seq_mapping = {}
+    for kind in zone_sequence.KINDS:
+        seq_mapping.update(zone_seq.mapping(kind))
+    tazseq_mapping = dict(zip(range(1,zone_seq.count('TAZ') + 1),zone_seq.nodes('TAZ').tolist()))
+    mazseq_mapping = dict(zip(range(1,zone_seq.count('MAZ') + 1),zone_seq.nodes('MAZ').tolist()))
+    tapseq_mapping = dict(zip(range(1,zone_seq.count('TAP') + 1),zone_seq.nodes('TAP').tolist()))
+
+    print 'reading maz->taz'
+    #read maz->taz mapping
+    maz_data = zone_data.read_columns(input_files['maz_data'],['MAZ_ORIGINAL','TAZ_ORIGINAL'])
+    mazn_tazn_mapping = dict(zip(maz_data['MAZ_ORIGINAL'].tolist(),maz_data['TAZ_ORIGINAL'].tolist()))
+
+    #read param block
+    print 'reading hwy parameter block data'
+    block_data = readBlockFile(input_files['hwy_param'])
+    auto_op_cost = block_data['AUTOOPCOST'] / 5280 #correct for feet
+    vot = 0.6 / block_data['VOT'] #turn into minutes / cents
+    walk_rate = 60.0 / 3.0 / 5280.0
+
+    print 'reading maz->tap skims and building tap->maz/taz lookup'
+    #read maz->tap walk skims
+    #build tap-> (closest) (maz,taz,maz->tap walk_time)
+    tapn_tazn_lookup = {}
+    tapns = {}
+    for line in open(input_files['ped_maz_tap']):
+        line = line.strip().split(',')
+        mazn = mazseq_mapping[int(line[0])]
+        tapn = tapseq_mapping[int(line[1])]
+        distance = float(line[4])
+        walk_time = walk_rate*distance
+        tapns[tapn] = None
+        tazn = mazn_tazn_mapping[mazn]
+        if (not tapn in tapn_tazn_lookup) or (tapn_tazn_lookup[tapn][2] > walk_time):
+            tapn_tazn_lookup[tapn] = (mazn,tazn,walk_time,distance)
+    tapns = list(tapns.keys())
+    tapns.sort()
+
+
+    print 'reading transit lines'
+    #read transit lines to pull out tod and stop information
+    transit_lines = transit_line_file.TransitLineFile.read(input_files['transit_lines'])
+    stops_by_tod_and_mode = {}
+    for period in periods:
+        stops_by_tod_and_mode[period] = {}
+        for mode in modes:
+            stops_by_tod_and_mode[period][mode] = set(transit_lines.stops(period,mode).tolist())
+
+
+    print 'building tap->mode'
+    tapn_to_mode = {}
+    for line in open(input_files['tap_nodes']):
+        tapn,mode = map(int,line.strip().split(','))
+        tapn_to_mode[tapn] = id_mode_map[mode]
+
+
+    print 'building tod->mode->taps'
+    tod_mode_tapn = {}
+    for period in periods:
+        tod_mode_tapn[period] = {}
+        for mode_id in id_mode_map:
+            tod_mode_tapn[period][id_mode_map[mode_id]] = {}
+    isolated_tapns = {}
+    for line in open(input_files['tap_links']):
+        a,b = map(int,line.strip().split(','))
+        if (a < 900000) and (a % 100000 > 90000):
+            tapn = a
+            stopn = b
+        else:
+            tapn = b
+            stopn = a
+        if not tapn in tapn_to_mode:
+            print 'tapn not found in (' + str(a) + ',' + str(b) + ')'
+            continue
+        mode = tapn_to_mode[tapn]
+        for period in periods:
+            if not tapn in tod_mode_tapn[period][mode]:
+                #check to see if tap is available in this period
+                if stopn in stops_by_tod_and_mode[period][mode]:
+                    if not tapn in tapn_tazn_lookup:
+                        isolated_tapns[tapn] = None
+                    else:
+                        tod_mode_tapn[period][mode][tapn] = tapn_tazn_lookup[tapn] #closest (mazn,tazn,walk_time from mazn to tapn,walk_distance from mazn to tapn)
+    print 'taps with no (apparent) walk access: ' + str(isolated_tapns.keys())
+
+    print 'building list of tazs with taps by tod'
+    tazs_with_taps = {} #period -> tazs
+    for period in periods:
+        tazs_with_taps[period] = {}
+        for mode in tod_mode_tapn[period]:
             for tapn in tod_mode_tapn[period][mode]:
-                tapn_costs = tod_mode_tapn[period][mode][tapn]
-                cost = tazn_tazn_skim[tazn][tapn_costs[1]][0] + tapn_costs[2]
-                if (drive_access_costs[period][mode][tazn] is None) or (drive_access_costs[period][mode][tazn][0] > cost):
-                    drive_access_costs[period][mode][tazn] = (cost,tapn)
-    
-print 'writing drive access skim results'
-f = open(drive_tansit_skim_out_file,'wb')
-f.write(','.join(['FTAZ','MODE','PERIOD','TTAP','TMAZ','TTAZ','DTIME','DDIST','DTOLL','WDIST']) + os.linesep)
-for period in drive_access_costs:
-    for mode in drive_access_costs[period]:
-        for tazn in drive_access_costs[period][mode]:
-            if not drive_access_costs[period][mode][tazn] is None:
-                tapn = drive_access_costs[period][mode][tazn][1]
-                (tmazn,ttazn,wtime,wdist) = tod_mode_tapn[period][mode][tapn]
-                (fcost,time,dist,toll) = tazn_tazn_skim[tazn][ttazn]
-                f.write(','.join(map(str,[seq_mapping[tazn],mode,period,seq_mapping[tapn],seq_mapping[tmazn],seq_mapping[ttazn],time,dist,toll,wdist])) + os.linesep)
-f.close()
-    
-end_time = pytime.time()
-print 'elapsed time in seconds: ' + str((end_time - start_time) / 1000.0)
+                tazs_with_taps[period][tod_mode_tapn[period][mode][tapn][1]] = None
+
+    #candidate taps are passed to the workers as lists so that their (tie-breaking) order survives pickling
+    candidates = {}
+    for period in periods:
+        candidates[period] = {}
+        for mode in modes:
+            candidates[period][mode] = [(tapn,tod_mode_tapn[period][mode][tapn][1],tod_mode_tapn[period][mode][tapn][2])
+                                        for tapn in tod_mode_tapn[period][mode]]
+
+    return ({'seq_mapping'    : seq_mapping,
+             'tazseq_mapping' : tazseq_mapping,
+             'candidates'     : candidates,
+             'tazs_with_taps' : tazs_with_taps,
+             'auto_op_cost'   : auto_op_cost,
+             'vot'            : vot},tod_mode_tapn)
+
+if __name__ == '__main__':
+    base_dir = sys.argv[1]
+    block_dir = sys.argv[2]
+
+    #input files
+    #skim_taz_to_node_file = os.path.join(base_dir,r'hwy\avgload' + PERIOD_TOKEN + '_taz_to_node.txt')
+    #taz_to_tazn_mapping_file = os.path.join(base_dir,r'hwy\node_maz_taz_data.csv')
+    #maz_to_taz_mapping_file = os.path.join(base_dir,r'hwy\node_maz_taz_lookup.csv')
+    maz_to_taz_mapping_file = os.path.join(base_dir,r'landuse\maz_data.csv')
+    hwy_parameter_block_file = os.path.join(block_dir,r'hwyParam.block')
+    drive_access_parameter_block_file = os.path.join(block_dir,r'driveAccessParam.block')
+    ped_maz_tap_distance_file = os.path.join(base_dir,r'skims\ped_distance_maz_tap.txt')
+    transit_lines_file = os.path.join(base_dir,r'trn\transitLines.lin')
+    network_tap_nodes_file = os.path.join(base_dir,r'hwy\mtc_final_network_tap_nodes.csv')
+    network_tap_links_file = os.path.join(base_dir,r'hwy\mtc_final_network_tap_links.csv')
+    skim_taz_taz_time_file = os.path.join(base_dir,r'skims\DA_' + PERIOD_TOKEN + '_taz_time.csv')
+    drive_tansit_skim_out_file = os.path.join(base_dir,r'skims\drive_maz_taz_tap.csv')
+    drive_tansit_egress_skim_out_file = os.path.join(base_dir,r'skims\drive_maz_taz_tap_egress.csv')
+    drive_access_manifest_file = os.path.join(base_dir,r'skims\drive_maz_taz_tap_manifest.pkl')
+    n_seq_file = os.path.join(base_dir,r'hwy\mtc_final_network_zone_seq.csv')
+
+
+
+    start_time = pytime.time()
+
+    #drive access settings are optional; 0 workers means one per processor
+    drive_access_data = {}
+    if os.path.exists(drive_access_parameter_block_file):
+        drive_access_data = readBlockFile(drive_access_parameter_block_file)
+    workers = int(drive_access_data.get('DRIVE_ACCESS_WORKERS',0))
+    if workers < 1:
+        workers = multiprocessing.cpu_count()
+    taps_per_taz = int(drive_access_data.get('DRIVE_ACCESS_TAPS',1))
+    max_time = drive_access_data.get('DRIVE_ACCESS_MAX_TIME',0.0)
+    max_cost = drive_access_data.get('DRIVE_ACCESS_MAX_COST',0.0)
+    egress = drive_access_data.get('DRIVE_ACCESS_EGRESS',0) > 0
+
+    incremental = drive_access_data.get('DRIVE_ACCESS_INCREMENTAL',0) > 0
+
+    input_files = {'zone_seq'      : n_seq_file,
+                   'maz_data'      : maz_to_taz_mapping_file,
+                   'hwy_param'     : hwy_parameter_block_file,
+                   'ped_maz_tap'   : ped_maz_tap_distance_file,
+                   'transit_lines' : transit_lines_file,
+                   'tap_nodes'     : network_tap_nodes_file,
+                   'tap_links'     : network_tap_links_file}
+
+    #in incremental mode, reuse the lookups and the per period/mode results from the manifest wherever their inputs are unchanged
+    manifest = None
+    if incremental:
+        print 'hashing inputs'
+        input_hashes = {}
+        for name in input_files:
+            input_hashes[name] = file_cache.hash_file(input_files[name])
+        skim_hashes = {}
+        for period in periods:
+            skim_hashes[period] = file_cache.hash_file(skim_taz_taz_time_file.replace(PERIOD_TOKEN,period))
+        if os.path.exists(drive_access_manifest_file):
+            print 'reading manifest ' + drive_access_manifest_file
+            with open(drive_access_manifest_file,'rb') as f:
+                manifest = cPickle.load(f)
+
+    if (manifest is not None) and (manifest['inputs'] == input_hashes):
+        print 'lookup inputs unchanged, using lookups from manifest'
+        (lookups,tod_mode_tapn) = (manifest['lookups'],manifest['tod_mode_tapn'])
+    else:
+        (lookups,tod_mode_tapn) = buildLookups(input_files)
+    lookups['taps_per_taz'] = taps_per_taz
+    lookups['max_time'] = max_time
+    lookups['max_cost'] = max_cost
+    lookups['egress'] = egress
+    lookups['skim_taz_taz_time_file'] = skim_taz_taz_time_file
+
+    #work out which period/modes need to be (re)built
+    signatures = {}
+    drive_costs = {}
+    tasks = []
+    for period in periods:
+        signatures[period] = {}
+        drive_costs[period] = {}
+        period_modes = []
+        for mode in modes:
+            if incremental:
+                signatures[period][mode] = resultSignature(lookups,input_hashes['zone_seq'],skim_hashes[period],period,mode)
+            if (manifest is not None) and (manifest['signatures'][period].get(mode) == signatures[period][mode]):
+                drive_costs[period][mode] = manifest['results'][period][mode]
+            else:
+                period_modes.append(mode)
+        if len(period_modes) > 0:
+            tasks.append((period,period_modes))
+        else:
+            print 'inputs unchanged for period ' + period + ', using results from manifest'
+
+    # tod_mode_tapn[period][mode][tapn] = (mazn,tazn,walk_time,distance)
+    workers = min(workers,len(tasks))
+    if workers > 1:
+        print 'building ' + str(len(tasks)) + ' periods with ' + str(workers) + ' worker processes'
+        pool = multiprocessing.Pool(processes=workers,initializer=initWorker,initargs=(lookups,))
+        task_results = pool.map(buildPeriod,tasks)
+        pool.close()
+        pool.join()
+    else:
+        initWorker(lookups)
+        task_results = map(buildPeriod,tasks)
+    for i in range(len(tasks)):
+        drive_costs[tasks[i][0]].update(task_results[i])
+
+    if incremental:
+        print 'writing manifest ' + drive_access_manifest_file
+        with open(drive_access_manifest_file,'wb') as f:
+            cPickle.dump({'inputs'        : input_hashes,
+                          'lookups'       : lookups,
+                          'tod_mode_tapn' : tod_mode_tapn,
+                          'signatures'    : signatures,
+                          'results'       : drive_costs},f,cPickle.HIGHEST_PROTOCOL)
+
+    #drive_costs[period][mode] = (access,egress)
+    drive_access_costs = {}
+    drive_egress_costs = {}
+    for period in periods:
+        drive_access_costs[period] = {}
+        drive_egress_costs[period] = {}
+        for mode in modes:
+            (drive_access_costs[period][mode],drive_egress_costs[period][mode]) = drive_costs[period][mode]
 
+    print 'writing drive access skim results'
+    writeDriveSkim(drive_tansit_skim_out_file,drive_access_costs,tod_mode_tapn,lookups['seq_mapping'],taps_per_taz)
+    if egress:
+        print 'writing drive egress skim results'
+        writeDriveSkim(drive_tansit_egress_skim_out_file,drive_egress_costs,tod_mode_tapn,lookups['seq_mapping'],taps_per_taz)
 
-        
+    end_time = pytime.time()
+    print 'elapsed time in seconds: ' + str((end_time - start_time) / 1000.0)
@@ -11,39 +11,18 @@
 
     outputs: out_link_file - the output transit line file, with updated node numbers
 
+    To transfer several files with the same mapping, use renumber_nodes.py, which reads the mapping once.
+
     crf 8/2013
 
 """
-import os,sys,math
-
-line_file = sys.argv[1]
-out_line_file = sys.argv[2]
-node_mapping = sys.argv[3]
+import os,sys
+import renumber_nodes
 
-#first, read in the node mapping
-node_map = {}
-for line in open(node_mapping):
-    #N,OLD_NODE
-    line = line.strip().split()
-    if len(line) < 2:
-        continue
-    node_map[int(line[1].strip())] = int(line[0].strip())
+if __name__ == '__main__':
+    line_file = sys.argv[1]
+    out_line_file = sys.argv[2]
+    node_mapping = sys.argv[3]
 
-#next, read in the transit lines, change the node, and write out the results
-f = open(out_line_file,'wb')
-for line in open(line_file):
-    line = line.strip().split(' N=')
-    if len(line) < 2: #keep everything before node sequence as-is
-        f.write(line[0] + os.linesep)
-        continue
-    f.write(line[0] + ' N=')
-    seq = []
-    for n in line[1].split(','):
-        n = int(n)
-        #make sure that the sign of the nodes (for stop/pass-through) is retained
-        sign = int(math.copysign(1,n))
-        new_n = sign*node_map[n*sign]
-        seq.append(new_n)
-    f.write(','.join(map(str,seq)) + os.linesep)
-f.close()
-        
+    #the transfer is done by renumber_nodes.py, which can also do many files (of both kinds) at once
+    renumber_nodes.renumberFiles(node_mapping,[('line',line_file,out_line_file)])
@@ -19,6 +19,9 @@ USAGE=r"""
     stops to pseudo TAPs, and
     pseudo TAP to pseudo TAPs.
 
+  The TAP to pseudo TAP mapping is an array lookup, and the TAP-to-TAP file is streamed to the link file in
+  chunks of CHUNK_ROWS rows.  The pseudo TAPs of nodes that are not TAPs are written as empty fields.
+
   Update:  sn  (11/2/2014): Added code to compute eucledian distances between pseudo-taps and stops
            lmz (3/10/2015): Consolidated multiple python scripts and use pandas.
 """
@@ -27,9 +30,27 @@ import os,sys
 import numpy
 import pandas
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','common'))
+import zone_sequence
+
 PSEUDO_TAP_START    = 901000
 PSEUDO_TAP_X_OFFSET = 7.0
 PSEUDO_TAP_Y_OFFSET = 7.0
+CHUNK_ROWS          = 1000000
+
+def pseudoTaps(tap_seq, nodes):
+    """ Returns the pseudo TAP of each of the nodes (an array), from tap_seq, the dense (node -> TAPSEQ) lookup
+    array, as a float array; NaN for nodes that are not TAPs.
+    """
+    seqs                    = zone_sequence.lookup(tap_seq, nodes)
+    return numpy.where(seqs > 0, seqs + PSEUDO_TAP_START, numpy.nan)
+
+def nodeColumn(values):
+    """ Returns the (float) node array values as strings of integers, with NaNs as empty strings.
+    """
+    strings = numpy.where(numpy.isnan(values), 0, values).astype(numpy.int64).astype(str).astype(object)
+    strings[numpy.isnan(values)] = ''
+    return strings
 
 if __name__ == '__main__':
     if len(sys.argv) != 3:
@@ -49,7 +70,7 @@ if __name__ == '__main__':
 
     # Create the pseudo taps - these are just all the TAP nodes + PSEUDO_TAP_START
     taps.is_copy            = False # quit your warnings
-    taps.sort(columns='TAPSEQ', inplace=True)
+    taps                    = taps.iloc[numpy.argsort(taps.TAPSEQ.values, kind='mergesort')]
     taps['PSEUDO_TAP_N']    = taps.TAPSEQ + PSEUDO_TAP_START
     taps['PSEUDO_TAP_X']    = taps.X      + PSEUDO_TAP_X_OFFSET
     taps['PSEUDO_TAP_Y']    = taps.Y      + PSEUDO_TAP_Y_OFFSET
@@ -58,56 +79,51 @@ if __name__ == '__main__':
 
     print taps.head()
 
-    # Convert the TAP to STOP nodes to PSEUDO TAP to STOP nodes
+    # TAP node -> TAPSEQ, and node -> coordinates (by sorted node)
+    tap_seq                 = numpy.zeros(taps.N.max() + 1 if taps.shape[0] > 0 else 1, dtype=numpy.int32)
+    tap_seq[taps.N.values]  = taps.TAPSEQ.values
+    node_order              = numpy.argsort(transit_nodes.N.values, kind='mergesort')
+    sorted_nodes            = transit_nodes.N.values[node_order]
+    def nodeCoords(nodes, offset=0.0):
+        position            = numpy.minimum(numpy.searchsorted(sorted_nodes, nodes), len(sorted_nodes) - 1)
+        found               = sorted_nodes[position] == nodes
+        return [numpy.where(found, transit_nodes[col].values[node_order[position]] + offset, numpy.nan) for col in ['X','Y']]
+
+    # Convert the TAP to STOP nodes to PSEUDO TAP to STOP nodes, with the Euclidean distance
     tap_to_stops            = pandas.read_table(tap_to_stops_file, names=['A','B'], delimiter=',')
-    # tap_to_stops.A_MOD      = tap_to_stops.A % 100000
-    # print tap_to_stops.A_MOD.describe()
-    # print tap_to_stops[tap_to_stops.B<1000000]
-
-    tap_to_stops            = pandas.merge(left=tap_to_stops, right=taps, how='left',
-                                           left_on='A', right_on='N')
-    tap_to_stops            = tap_to_stops[['PSEUDO_TAP_N','PSEUDO_TAP_X','PSEUDO_TAP_Y','B']]
-
-    # Get the STOP node coords
-    tap_to_stops            = pandas.merge(left=tap_to_stops, right=transit_nodes, how='left',
-                                          left_on='B', right_on='N')
-    # Calculate the Euclidean distance
-    tap_to_stops['FEET_SQ'] = (tap_to_stops.PSEUDO_TAP_X-tap_to_stops.X)*(tap_to_stops.PSEUDO_TAP_X-tap_to_stops.X) + \
-                              (tap_to_stops.PSEUDO_TAP_Y-tap_to_stops.Y)*(tap_to_stops.PSEUDO_TAP_Y-tap_to_stops.Y)
-    tap_to_stops['FEET']    = numpy.sqrt(tap_to_stops.FEET_SQ)
-
-    # this is what we'll write out
-    pseudo_tap_links        = tap_to_stops[['PSEUDO_TAP_N','B','FEET']]
-    pseudo_tap_links.rename(columns={'PSEUDO_TAP_N':'A_N', 'B':'B_N'}, inplace=True)
-
-    # reverse it and concatenate
-    pseudo_tap_reverse      = pseudo_tap_links.copy()
-    pseudo_tap_reverse.rename(columns={'A_N':'B_N', 'B_N':'C_N'}, inplace=True)
-    pseudo_tap_reverse.rename(columns={'C_N':'A_N'}, inplace=True)
-    pseudo_tap_links        = pseudo_tap_links.append(pseudo_tap_reverse).reset_index()
-    pseudo_tap_links.sort(columns=["index","A_N"], inplace=True)
-
-    # Read the TAP to TAP links
-    ped_tap_tap_df          = pandas.DataFrame.from_csv(ped_tap_tap_file)
-    ped_tap_tap_df.reset_index(inplace=True)
-
-    # Make them Pseudo TAP to Pseudo TAP links
-    ped_tap_tap_df          = pandas.merge(left=ped_tap_tap_df, right=taps, how='left',
-                                           left_on='ORIG_TAP_N', right_on='N')
-    ped_tap_tap_df          = ped_tap_tap_df[['PSEUDO_TAP_N','DEST_TAP_N','FEET']]
-    ped_tap_tap_df.rename(columns={'PSEUDO_TAP_N':'A_N'}, inplace=True)
-    ped_tap_tap_df          = pandas.merge(left=ped_tap_tap_df, right=taps, how='left',
-                                           left_on='DEST_TAP_N', right_on='N')
-    ped_tap_tap_df          = ped_tap_tap_df[['A_N','PSEUDO_TAP_N','FEET']]
-    ped_tap_tap_df.rename(columns={'PSEUDO_TAP_N':'B_N'}, inplace=True)
-
-    # Add them to our list
-    pseudo_tap_links        = pseudo_tap_links.append(ped_tap_tap_df)
-
-    # One more column
+    pseudo_tap              = pseudoTaps(tap_seq, tap_to_stops.A.values)
+    (pseudo_x, pseudo_y)    = nodeCoords(numpy.where(numpy.isnan(pseudo_tap), -1, tap_to_stops.A.values), PSEUDO_TAP_X_OFFSET)
+    (stop_x, stop_y)        = nodeCoords(tap_to_stops.B.values)
+    feet                    = numpy.sqrt((pseudo_x-stop_x)*(pseudo_x-stop_x) + (pseudo_y-stop_y)*(pseudo_y-stop_y))
+
+    # each link is followed or preceded by its reverse (stop to pseudo TAP), whichever has the lower A node first
+    stop                    = tap_to_stops.B.values.astype(numpy.float64)
+    reverse_first           = stop < numpy.where(numpy.isnan(pseudo_tap), numpy.inf, pseudo_tap)
+    links                   = len(tap_to_stops)
+    first                   = numpy.arange(links) * 2 + reverse_first
+    second                  = numpy.arange(links) * 2 + ~reverse_first
+    (a_n, b_n)              = (numpy.zeros(2 * links), numpy.zeros(2 * links))
+    (a_n[first], b_n[first])   = (pseudo_tap, stop)
+    (a_n[second], b_n[second]) = (stop, pseudo_tap)
+    pseudo_tap_links        = pandas.DataFrame({'A_N':nodeColumn(a_n), 'B_N':nodeColumn(b_n), 'FEET':numpy.repeat(feet, 2)})
     pseudo_tap_links['CNTYPE'] = 'TRWALK'
-    pseudo_tap_links = pseudo_tap_links[['A_N','B_N','CNTYPE','FEET']]
 
-    # Write it
-    pseudo_tap_links.to_csv(pseudo_tap_links_outfile, index=False)
-    print "Wrote %d pseudo tap links" % pseudo_tap_links.shape[0]
\ No newline at end of file
+    with open(pseudo_tap_links_outfile, 'w') as f:
+        pseudo_tap_links[['A_N','B_N','CNTYPE','FEET']].to_csv(f, index=False)
+        link_count          = pseudo_tap_links.shape[0]
+        unmapped            = numpy.isnan(pseudo_tap).sum()
+
+        # Read the TAP to TAP links (in chunks), and make them Pseudo TAP to Pseudo TAP links
+        for ped_tap_tap_df in pandas.read_csv(ped_tap_tap_file, chunksize=CHUNK_ROWS):
+            a_n                      = pseudoTaps(tap_seq, ped_tap_tap_df.ORIG_TAP_N.values)
+            b_n                      = pseudoTaps(tap_seq, ped_tap_tap_df.DEST_TAP_N.values)
+            unmapped                += (numpy.isnan(a_n) | numpy.isnan(b_n)).sum()
+            ped_tap_tap_df['A_N']    = nodeColumn(a_n)
+            ped_tap_tap_df['B_N']    = nodeColumn(b_n)
+            ped_tap_tap_df['CNTYPE'] = 'TRWALK'
+            ped_tap_tap_df[['A_N','B_N','CNTYPE','FEET']].to_csv(f, index=False, header=False)
+            link_count         += ped_tap_tap_df.shape[0]
+
+    print "Wrote %d pseudo tap links" % link_count
+    if unmapped > 0:
+        print "%d of them are from/to nodes that are not TAPs (written with an empty pseudo TAP)" % unmapped
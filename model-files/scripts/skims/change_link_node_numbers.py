@@ -12,34 +12,19 @@
     outputs: out_link_file - the output (csv) file, which looks exactly like the input, only
                              with updated node numbers
 
+    To transfer several files with the same mapping, use renumber_nodes.py, which reads the mapping once.
+
     crf 9/2013
 
 """
 
 import os,sys
+import renumber_nodes
+
+if __name__ == '__main__':
+    link_file = sys.argv[1]
+    out_link_file = sys.argv[2]
+    node_mapping = sys.argv[3]
 
-link_file = sys.argv[1]
-out_link_file = sys.argv[2]
-node_mapping = sys.argv[3]
-
-#first collect all of the node mappings
-node_map = {}
-for line in open(node_mapping):
-    #N,OLD_NODE
-    line = line.strip().split()
-    if len(line) < 2:
-        continue
-    node_map[int(line[1].strip())] = int(line[0].strip())
-
-#now read the link file, transfer the a/b nodes, and write the new file
-f = open(out_link_file,'wb')
-for line in open(link_file):
-    line = line.strip().split(',')
-    if len(line) < 2:
-        f.write(line[0] + os.linesep)
-        continue
-    #only changing first two entries
-    line[0] = str(node_map[int(line[0])])
-    line[1] = str(node_map[int(line[1])])
-    f.write(','.join(line) + os.linesep)
-f.close()
+    #the transfer is done by renumber_nodes.py, which can also do many files (of both kinds) at once
+    renumber_nodes.renumberFiles(node_mapping,[('link',link_file,out_link_file)])
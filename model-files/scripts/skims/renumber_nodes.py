@@ -0,0 +1,138 @@
+"""
+    renumber_nodes.py node_mapping_file in_file out_file [in_file out_file ...]
+
+    This script uses an existing node mapping file to transfer any number of link and transit line files
+    to an updated numbering scheme in a single run. The mapping is read once, into a lookup array, and the
+    files are transferred concurrently (one per worker process, up to one per processor). BuildTransitNetworks.job
+    uses it to transfer the congested link times of all periods and the transit line file together; it is also
+    used by change_link_node_numbers.py and build_new_transit_line.py, which transfer a single file.
+
+    inputs: node_mapping_file - the location of the node mapping file, which has (whitespace separated)
+                                columns (new_node,old_node), and no header
+            in_file - an input file, either
+                        a transit line file (ending in .lin), with each entry ending in a N=... node sequence;
+                            all line data (including stop/pass-through nodes) is retained
+                        a link csv file (anything else), with columns (a_node,b_node,....); all columns
+                            subsequent to the first two are retained as they are currently written
+
+    outputs: out_file - the output file for the preceding in_file, which looks exactly like the input, only
+                        with updated node numbers
+
+    The files are streamed in chunks. In a link file, the a/b nodes of a chunk are renumbered together and the
+    rest of each line is copied as is (see renumber_columns.py); in a line file, the node sequences of a chunk
+    are renumbered together, with their signs (stop/pass-through) retained. Any node missing from the mapping
+    is an error.
+
+"""
+
+import os,sys
+import multiprocessing
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','common'))
+import renumber_columns
+
+#old node -> new node lookup (-1 if not mapped); set by initWorker in each (worker) process
+node_table = None
+
+def readNodeMapping(node_mapping_file):
+    """ Reads the node mapping file into a lookup array, indexed by old node, of new nodes (-1 if not mapped).
+    """
+    #N,OLD_NODE
+    mapping = [line.split()[:2] for line in open(node_mapping_file)]
+    mapping = numpy.array([entry for entry in mapping if len(entry) == 2]).astype(numpy.int64).reshape(-1,2)
+    table = numpy.zeros(mapping[:,1].max() + 1 if len(mapping) > 0 else 0,dtype=numpy.int32) - 1
+    table[mapping[:,1]] = mapping[:,0]
+    return table
+
+def initWorker(table):
+    """ Stores the node lookup (read once by the main process) for use by the file transfers.
+    """
+    global node_table
+    node_table = table
+
+def mapNodes(nodes):
+    """ Returns the new numbers of the (old, non-negative) nodes in the array nodes.
+    """
+    mapped = (nodes >= 0) & (nodes < len(node_table))
+    new_nodes = numpy.zeros(nodes.shape,dtype=numpy.int64) - 1
+    new_nodes[mapped] = node_table[nodes[mapped]]
+    if (new_nodes < 0).any():
+        raise KeyError(nodes[new_nodes < 0][0])
+    return new_nodes
+
+def renumberLinkFile(link_file,out_link_file):
+    """ Transfers the a/b nodes (first two entries) of the link csv file to the new numbering.
+    """
+    with open(link_file) as f:
+        with open(out_link_file,'wb') as of:
+            for chunk in renumber_columns.read_chunks(f):
+                of.write(renumber_columns.renumber_lines(chunk,mapNodes,keep_short=True))
+
+def renumberLineFile(line_file,out_line_file):
+    """ Transfers the node sequences (N=...) of the transit line file to the new numbering, keeping the sign of
+    the nodes (for stop/pass-through).
+    """
+    with open(line_file) as f:
+        with open(out_line_file,'wb') as of:
+            for chunk in renumber_columns.read_chunks(f):
+                lines = []
+                sequences = []
+                for line in chunk.split('\n')[:-1]:
+                    line = line.strip().split(' N=')
+                    if len(line) < 2: #keep everything before node sequence as-is
+                        lines.append(line[0])
+                        continue
+                    lines.append(line[0] + ' N=')
+                    sequences.append((len(lines) - 1,line[1]))
+                if len(sequences) > 0:
+                    #all of the chunk's node sequences, renumbered at once
+                    nodes = numpy.fromstring(','.join(sequence for (i,sequence) in sequences),dtype=numpy.int64,sep=',')
+                    counts = [sequence.count(',') + 1 for (i,sequence) in sequences]
+                    if len(nodes) != sum(counts):
+                        raise ValueError('invalid node sequence in ' + line_file)
+                    nodes = (numpy.sign(nodes) + (nodes == 0))*mapNodes(numpy.abs(nodes))
+                    nodes = nodes.astype(str).tolist()
+                    offset = 0
+                    for j in range(len(sequences)):
+                        lines[sequences[j][0]] += ','.join(nodes[offset:offset + counts[j]])
+                        offset += counts[j]
+                of.write(''.join(line + os.linesep for line in lines))
+
+def fileKind(in_file):
+    """ Returns the kind of in_file, by its extension: 'line' for a transit line file, otherwise 'link'.
+    """
+    return 'line' if in_file.lower().endswith('.lin') else 'link'
+
+def renumberFile(task):
+    """ Transfers a file to the new numbering; task is (kind,in_file,out_file), kind being 'link' or 'line'.
+    """
+    (kind,in_file,out_file) = task
+    if kind == 'line':
+        renumberLineFile(in_file,out_file)
+    else:
+        renumberLinkFile(in_file,out_file)
+    print 'renumbered ' + in_file + ' to ' + out_file
+
+def renumberFiles(node_mapping_file,files):
+    """ Transfers the files, a list of (kind,in_file,out_file) (see renumberFile), to the numbering in
+    node_mapping_file.
+    """
+    table = readNodeMapping(node_mapping_file)
+    workers = min(len(files),multiprocessing.cpu_count())
+    if workers > 1:
+        pool = multiprocessing.Pool(processes=workers,initializer=initWorker,initargs=(table,))
+        pool.map(renumberFile,files)
+        pool.close()
+        pool.join()
+    else:
+        initWorker(table)
+        map(renumberFile,files)
+
+if __name__ == '__main__':
+    node_mapping = sys.argv[1]
+    files = sys.argv[2:]
+    if (len(files) == 0) or (len(files) % 2 != 0):
+        print __doc__
+        sys.exit(2)
+    renumberFiles(node_mapping,[(fileKind(files[i]),files[i],files[i + 1]) for i in range(0,len(files),2)])
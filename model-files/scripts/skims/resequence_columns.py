@@ -5,19 +5,99 @@ USAGE: python resequence_columns.py skim_file_in.csv [skim_file_in2.csv ...] ski
 Reads skim_file_in.csv and replaces columns in the file based on the column names and
 the mapping in hwy/mtc_final_network_zone_seq.csv
 
-If multiple skim_file_in.csvs are specified, then joins them on their common fields first.
+If multiple skim_file_in.csvs are specified, then joins them on their common fields first; their rows must
+line up (same number of rows, with the common fields equal row by row).
 
  - XXX_TAZ_N : maps N to TAZSEQ, new column is XXX_TAZ
  - XXX_MAZ_N : maps N to MAZSEQ, new column is XXX_MAZ
  - XXX_TAP_N : maps N to TAPSEQ, new column is XXX_TAP
  - XXX_EXT_N : maps N to EXTSEQ, new column is XXX_EXT
 
+The skims are processed in chunks of CHUNK_ROWS rows, so memory use does not depend on the skim size.
+Multiple inputs are joined positionally, a chunk at a time, after checking that their common fields match
+row by row; inputs that do not line up stop the script (with return code 2), naming the first mismatched row.
+Each XXX_YYY_N column is mapped through the zone sequence lookup array; the other columns are copied as
+they are written in the input. Any null or unmapped node stops the script (with return code 2).
+
 TODO: is there a need to go backwards?
 
 """
-import datetime,sys,os
+import datetime,itertools,sys,os
 import numpy, pandas
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','common'))
+import zone_sequence
+
+CHUNK_ROWS = 1000000
+NODE_SUFFIXES = ['_TAZ_N','_MAZ_N','_TAP_N','_EXT_N']
+
+class SkimsDoNotLineUp(Exception):
+    pass
+
+def isNodeColumn(colname):
+    return len(colname) >= 6 and colname[-6:] in NODE_SUFFIXES
+
+def readColumns(skim_infile):
+    """ Returns the column names of skim_infile, and the dtypes to read them with: nodes as numbers, and the
+    rest as (unparsed) text.
+    """
+    columns = list(pandas.read_csv(skim_infile, nrows=0).columns.values)
+    return columns, dict((colname, numpy.float64 if isNodeColumn(colname) else str) for colname in columns)
+
+def joinedChunks(skim_infiles):
+    """ Yields the input skims in chunks of CHUNK_ROWS rows, joined positionally. Raises SkimsDoNotLineUp, naming
+    the first mismatched (data) row, if the inputs have different numbers of rows or their common fields do not
+    match row by row.
+    """
+    readers = [pandas.read_csv(skim_infile, skip_blank_lines=True, dtype=readColumns(skim_infile)[1], # last line of skim is funny
+                               chunksize=CHUNK_ROWS) for skim_infile in skim_infiles]
+    rows = 0
+    for chunks in itertools.izip_longest(*readers):
+        lengths = [0 if chunk is None else chunk.shape[0] for chunk in chunks]
+        if min(lengths) != max(lengths):
+            raise SkimsDoNotLineUp('The skims have different numbers of rows: %s ends after row %d.' %
+                                   (skim_infiles[lengths.index(min(lengths))], rows + min(lengths)))
+        skim_df = chunks[0].reset_index(drop=True)
+        for i in range(1, len(chunks)):
+            my_skim_df = chunks[i].reset_index(drop=True)
+            common = [colname for colname in my_skim_df.columns.values if colname in skim_df.columns.values]
+            mismatched = numpy.flatnonzero((my_skim_df[common].values != skim_df[common].values).any(axis=1))
+            if len(mismatched) > 0:
+                raise SkimsDoNotLineUp('The common fields %s of %s do not match those of %s at row %d.' %
+                                       (common, skim_infiles[i], skim_infiles[:i], rows + mismatched[0] + 1))
+            skim_df = pandas.concat([skim_df, my_skim_df.drop(common, axis=1)], axis=1)
+        rows += skim_df.shape[0]
+        yield skim_df
+
+def resequence(skim_df, zone_seq):
+    """ Replaces the XXX_YYY_N columns of skim_df with XXX_YYY columns holding the YYYSEQ of the nodes, in place
+    (keeping the column order). Raises ValueError if there are any nulls or unmapped nodes.
+    """
+    for colname in list(skim_df.columns.values):
+        new_colname = colname[:-2] if isNodeColumn(colname) else colname
+        nulls = skim_df[colname].isnull().sum()
+        if nulls > 0:
+            raise ValueError("There are %d instances of null %s." % (nulls, new_colname))
+        if new_colname == colname:
+            continue
+        seqs = zone_seq.to_seq(skim_df[colname].values.astype(numpy.int64), colname[-5:-2])
+        # nodes that are not zones of the kind are looked up as 0
+        if (seqs == 0).any():
+            raise ValueError("There are %d instances of unmapped %s." % ((seqs == 0).sum(), new_colname))
+        skim_df[colname] = seqs
+        skim_df.rename(columns={colname:new_colname}, inplace=True)
+
+def writeSkims(skim_chunks, zone_seq, skim_outfile):
+    """ Resequences the skim chunks and writes them to skim_outfile. Returns the number of rows written.
+    """
+    rows = 0
+    with open(skim_outfile, 'w') as f:
+        for skim_df in skim_chunks:
+            resequence(skim_df, zone_seq)
+            skim_df.to_csv(f, index=False, header=(rows == 0))
+            rows += skim_df.shape[0]
+    return rows
+
 if __name__ == '__main__':
 
     zone_seq_mapping_file   = os.path.join('hwy','mtc_final_network_zone_seq.csv')
@@ -27,55 +107,26 @@ if __name__ == '__main__':
     print "%s resequence_columns.py %s %s" % (datetime.datetime.now().strftime("%c"),
                                               str(skim_infiles), skim_outfile)
 
-    sequence_mapping        = pandas.DataFrame.from_csv(zone_seq_mapping_file)
-    sequence_mapping.reset_index(inplace=True)
-    actions_performed       = 0
+    zone_seq                = zone_sequence.ZoneSequence.read(zone_seq_mapping_file)
 
-    # read the input skims, joining if necessary
-    skim_df                 = None
-    skim_df_init            = False
+    # the actions are joining the input skims, and resequencing the node columns
+    colnames                = []
     for skim_infile in skim_infiles:
-        my_skim_df          = pandas.io.parsers.read_csv(skim_infile, skip_blank_lines=True) # last line of skim is funny
-        my_skim_df.reset_index(drop=True,inplace=True)
-
-        if not skim_df_init:
-            skim_df         = my_skim_df
-            skim_df_init    = True
-        else:
-            prev_len        = skim_df.shape[0]
-            assert(my_skim_df.shape[0] == prev_len)
-            skim_df         = skim_df.merge(right=my_skim_df, how='inner')
-            assert(   skim_df.shape[0] == prev_len)
-            actions_performed += 1
-    print "%s input skims read" % datetime.datetime.now().strftime("%c")
-
-    # resequence
-    new_colnames = []
-    for colname in list(skim_df.columns.values):
-
-        if len(colname) >= 6 and colname[-6:] in ['_TAZ_N','_MAZ_N','_TAP_N','_EXT_N']:
-            new_colname = colname[:-2]           # e.g. XXX_TAZ
-            seq_colname = colname[-5:-2]+'SEQ'   # e.g. TAZSEQ
-            seq_df      = sequence_mapping.loc[:,['N',seq_colname]]
-            seq_df.rename(columns={'N':colname, seq_colname:new_colname}, inplace=True)
-            skim_df     = pandas.merge(left=skim_df, right=seq_df, how='left')
-            new_colnames.append(new_colname)
-            actions_performed += 1
-        else:
-            new_colnames.append(colname)
-
-    skim_df = skim_df[new_colnames]
+        colnames.extend(colname for colname in readColumns(skim_infile)[0] if colname not in colnames)
+    actions_performed       = len(skim_infiles) - 1 + len(filter(isNodeColumn, colnames))
 
     # verify we did *something*
     if actions_performed == 0:
         print "No actions performed -- something must be wrong"
         sys.exit(2)
 
-    # verify no joins failed
-    for colname in new_colnames:
-        if sum(skim_df[colname].isnull()) > 0:
-            print "There are %d instances of null %s." % (sum(skim_df[colname].isnull()), colname)
-            sys.exit(2)
+    try:
+        rows = writeSkims(joinedChunks(skim_infiles), zone_seq, skim_outfile)
+    except (SkimsDoNotLineUp, ValueError) as e:
+        # verify no joins failed
+        print e
+        if os.path.exists(skim_outfile):
+            os.remove(skim_outfile)
+        sys.exit(2)
 
-    skim_df.to_csv(skim_outfile, index=False)
-    print "%s done with %d actions performed" % (datetime.datetime.now().strftime("%c"), actions_performed)
+    print "%s done with %d actions performed (%d rows)" % (datetime.datetime.now().strftime("%c"), actions_performed, rows)
@@ -2,22 +2,62 @@
   Generate a list of lines served for each TAP
   Takes as input the transit lines file, the tap connectors, and the zone renumbering file
   Outputs a list of line names for each TAP
+
+  The lines of each TAP are found by multiplying two sparse incidence matrices, TAP x node (from the tap
+  connectors) and node x line (from the line stops), with the line names as integer codes. The TAPs are
+  written in sequential order, each with its line names in name order.
+
+  Usage: python tap_lines.py [by_period]
+
+  If by_period is given, trn\tapLines_EA.csv, etc., are also written, each holding only the lines running in
+  the time period (with a headway greater than 0).
+
   Ben Stabler, stabler@pbworld.com, 12/23/13
 """
 
-import os,sys,re, csv
+import os,sys
 import time as pytime
+import numpy, pandas
+import scipy.sparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','common'))
+import transit_line_file
+import zone_sequence
+
+def tapLineIncidence(tapNode, stopNodeIndex, lineCode, lineCount):
+  """
+  Returns the (tap x line) sparse incidence matrix (nonzero where a line stops at a node connected to the tap), from
+  the (tap x node) incidence matrix tapNode and the (node index, line code) pairs of the line stops.
+  """
+  nodeLine = scipy.sparse.csr_matrix((numpy.ones(len(stopNodeIndex)), (stopNodeIndex, lineCode)),
+                                     shape=(tapNode.shape[1], lineCount))
+  tapLine = (tapNode * nodeLine).tocsr()
+  tapLine.sort_indices()
+  return tapLine
+
+def writeTapLines(fileName, tapLine, lineNames):
+  """
+  Writes the tapLines file for CT-RAMP: the (sequential) tap and the (space separated) names of the lines of each tap
+  (row of tapLine) with any lines.
+  """
+  f = open(fileName,"wt")
+  f.write("TAP,LINES\n")
+  for tap in numpy.flatnonzero(numpy.diff(tapLine.indptr)).tolist():
+    lines = " ".join(lineNames[line] for line in tapLine.indices[tapLine.indptr[tap]:tapLine.indptr[tap + 1]].tolist())
+    f.write("%s,%s\n" % (tap + 1,lines))
+  f.close()
 
 ################################################################################
 
 base_dir = os.getcwd()
+byPeriod = len(sys.argv) > 1 and sys.argv[1] == 'by_period'
 
 #input files
-transit_line_file = os.path.join(base_dir,r'trn\transitLines.lin')
+transit_line_file_name = os.path.join(base_dir,r'trn\transitLines.lin')
 network_tap_links_file = os.path.join(base_dir,r'hwy\mtc_final_network_tap_links.csv')
 zone_seq_file = os.path.join(base_dir,r'hwy\mtc_final_network_zone_seq.csv')
 
-#output file
+#output file (and, by period, trn\tapLines_EA.csv, etc.)
 tap_lines_file = os.path.join(base_dir,r'trn\tapLines.csv')
 
 ################################################################################
@@ -25,68 +65,33 @@ tap_lines_file = os.path.join(base_dir,r'trn\tapLines.csv')
 start_time = pytime.time()
 
 print 'reading transit lines'
-linesByNode = dict()
-for line in open(transit_line_file):
-  split_line = map(str.strip,re.split('[=,]',line.strip()))
-  if len(split_line) < 3:
-    continue
-  
-  lineName = split_line[1]
-  for i in range(split_line.index('N') + 1,len(split_line)):
-    n = int(split_line[i])
-    if n > 0:
-      if n not in linesByNode:
-        linesByNode[n] = set()
-      linesByNode[n].add(lineName.replace('"',""))
+transit_lines = transit_line_file.TransitLineFile.read(transit_line_file_name)
+(stopNodes, stopLines) = transit_lines.stop_incidence()
+#line names as integer codes (in name order); lines with the same name share a code
+(lineNames, lineCodes) = numpy.unique(numpy.array(transit_lines.names, dtype=str), return_inverse=True)
+lineNames = lineNames.tolist()
 
 print 'reading tap connectors'
-access_links = []
-with open(network_tap_links_file, 'rb') as csvfile:
-  tapreader = csv.reader(csvfile, skipinitialspace=True)
-  for row in tapreader:
-    access_links.append(row)
+access_links = pandas.read_csv(network_tap_links_file, header=None, usecols=[0,1], skipinitialspace=True).values
 
 print 'reading zone sequence file'
-tapToSeqTap = dict()
-with open(zone_seq_file, 'rb') as csvfile:
-  tapreader = csv.reader(csvfile, skipinitialspace=True)
-  for row in tapreader:
-    node_id = int(row[0])
-    seq_tap_id = int(row[3])
-    if seq_tap_id > 0:
-      tapToSeqTap[node_id] = seq_tap_id
-
-#get nodes connected to each tap
-nodesByTap = dict()
-for linkRow in access_links:
-  tap = int(linkRow[0])
-  node = int(linkRow[1])
-  
-  if tap not in nodesByTap:
-    nodesByTap[tap] = set()
-  nodesByTap[tap].add(node)
-
-#get lines for each tap
-linesByTap = dict()
-for tap in tapToSeqTap.keys():
-  nodes = nodesByTap[tap]
-    
-  if tap not in linesByTap:
-    linesByTap[tap] = set()
-  for node in nodes:
-    if node in linesByNode:
-      lines = linesByNode[node]
-      for line in lines:
-        linesByTap[tap].add(line)
-
-#write out tapLines file for CT-RAMP
-f = file(tap_lines_file,"wt")
-f.write("TAP,LINES\n")
-for tap in linesByTap.keys():
-  lines = " ".join(list(linesByTap[tap]))
-  if lines != "":
-    f.write("%s,%s\n" % (tapToSeqTap[tap],lines))
-f.close()
+zone_seq = zone_sequence.ZoneSequence.read(zone_seq_file)
+
+#tap x node incidence, for the (sequential) taps and every node of a tap connector or line stop
+nodes = numpy.unique(numpy.concatenate((stopNodes, access_links[:,1])))
+linkTaps = zone_seq.to_seq(access_links[:,0], 'TAP')
+isTap = linkTaps > 0
+tapNode = scipy.sparse.csr_matrix((numpy.ones(isTap.sum()), (linkTaps[isTap] - 1, numpy.searchsorted(nodes, access_links[isTap,1]))),
+                                  shape=(zone_seq.count('TAP'), len(nodes)))
+stopNodeIndex = numpy.searchsorted(nodes, stopNodes)
+
+#get lines for each tap, and write out tapLines file for CT-RAMP
+writeTapLines(tap_lines_file, tapLineIncidence(tapNode, stopNodeIndex, lineCodes[stopLines], len(lineNames)), lineNames)
+if byPeriod:
+  for (period, headways) in zip(transit_line_file.PERIODS, transit_lines.headways.T):
+    running = headways[stopLines] > 0.0
+    writeTapLines(tap_lines_file.replace('.csv', '_' + period + '.csv'),
+                  tapLineIncidence(tapNode, stopNodeIndex[running], lineCodes[stopLines[running]], len(lineNames)), lineNames)
 
 end_time = pytime.time()
 print 'elapsed time in seconds: ' + str((end_time - start_time) / 1000.0)
@@ -0,0 +1,27 @@
+"""
+    test_renumber_columns.py
+
+    Tests of common/renumber_columns.py. Run from model-files/scripts with
+
+        python -m unittest discover tests
+"""
+
+import os,sys,unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','common'))
+import renumber_columns
+
+class RenumberLinesTest(unittest.TestCase):
+
+    def renumber(self,chunk):
+        return renumber_columns.renumber_lines(chunk,lambda numbers: numbers + 10)
+
+    def test_renumber(self):
+        self.assertEqual(self.renumber('1,2,a b\n 3 , 4 \n-5,+6\n'),os.linesep.join(['11,12,a b','13,14','5,16','']))
+
+    def test_invalid_numbers(self):
+        for line in ['1 2,3\n','1,2 3\n','1.0,2\n','a,2\n',',2\n','-,2\n','1-,2\n']:
+            self.assertRaises(ValueError,self.renumber,line)
+
+if __name__ == '__main__':
+    unittest.main()
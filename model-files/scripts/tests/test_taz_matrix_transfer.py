@@ -0,0 +1,46 @@
+"""
+    test_taz_matrix_transfer.py
+
+    Tests of assign/taz_matrix_transfer.py. Run from model-files/scripts with
+
+        python -m unittest discover tests
+"""
+
+import os,shutil,sys,tempfile,unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','assign'))
+import taz_matrix_transfer
+
+ZONE_SEQ = 'N,TAZSEQ,MAZSEQ,TAPSEQ,EXTSEQ\n101,1,0,0,0\n102,2,0,0,0\n10001,0,1,0,0\n'
+
+class TransferMatrixTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.zone_seq_file = os.path.join(self.dir,'mtc_final_network_zone_seq.csv')
+        with open(self.zone_seq_file,'wb') as f:
+            f.write(ZONE_SEQ)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def transfer(self,matrix):
+        (in_file,out_file) = (os.path.join(self.dir,'in.csv'),os.path.join(self.dir,'out.csv'))
+        with open(in_file,'wb') as f:
+            f.write(matrix)
+        taz_matrix_transfer.transferMatrix((self.zone_seq_file,in_file,out_file))
+        with open(out_file,'rb') as f:
+            return f.read()
+
+    def test_transfer(self):
+        self.assertEqual(self.transfer('orig,dest,trips\n101,102,1.5\n102,101,2\n'),
+                         os.linesep.join(['orig,dest,trips','1,2,1.5','2,1,2','']))
+
+    def test_unmapped_taz(self):
+        #10001 is a maz, not a taz
+        with self.assertRaises(ValueError) as raised:
+            self.transfer('orig,dest,trips\n101,102,1.5\n102,10001,2\n')
+        self.assertIn('10001',str(raised.exception))
+
+if __name__ == '__main__':
+    unittest.main()